@@ -11,22 +11,42 @@
 • Handles 2D Fourier Transforms (2d-FFT) and its inverse.
 • Plots the resulting 2D DFT on a log scale plot.
 the syntax for running the app is: 
-python3 fft.py [-m mode] [-i image]
+python3 fft.py [-m mode] [-i image] [-p] [-s] [--profile]
+or, to process many images without opening any window:
+python3 fft.py [-m mode] -b inputs... [-o output_dir] [-p] [-s]
 """
 
 import numpy as np
-import matplotlib.pyplot as plot
-import matplotlib.colors as colors
 import time
 import sys
 import os
 import argparse
-import cv2
+import glob
+import queue
+import threading
+import atexit
+from collections import OrderedDict
 
 # default values for argument 
 default_mode = 1
 default_image = "moonlanding.png"
 
+"""
+Lazy imports: matplotlib and cv2 are only loaded when a plot is drawn or an image file is read or written,
+so the transforms can be imported by a service without a display backend or the imaging dependency
+"""
+def _pyplot():
+    import matplotlib.pyplot as plot
+    return plot
+
+def _colors():
+    import matplotlib.colors as colors
+    return colors
+
+def _cv2():
+    import cv2
+    return cv2
+
 """
 Error handlers
 """
@@ -39,6 +59,248 @@ def invalid_image_error():
     print("ERROR! Invalid image. Please check the filename")
     exit(1)
 
+"""
+Instrumentation: opt-in timers and counters for the stages of the pipeline (decode, resize, row pass,
+column pass, inverses, denoise, compression, save). Every stage accumulates its calls, time and the bytes
+it allocated into profiler.stats, and a callback can receive each measurement as it happens.
+When the profiler is disabled, profile() returns a shared do-nothing stage, so it costs one attribute check
+"""
+class _Stage:
+    __slots__ = ("name", "nbytes", "start")
+
+    def __init__(self, name, nbytes):
+        self.name = name
+        self.nbytes = nbytes
+
+    # bytes allocated by the stage (typically the nbytes of the arrays it created)
+    def allocated(self, nbytes):
+        self.nbytes += nbytes
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        profiler.record(self.name, time.perf_counter() - self.start, self.nbytes)
+        return False
+
+class _NoStage:
+    __slots__ = ()
+
+    def allocated(self, nbytes):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_no_stage = _NoStage()
+
+class Profiler:
+    def __init__(self):
+        self.enabled = False
+        self.callback = None
+        self.stats = {}
+        self.lock = threading.Lock() # the batch loader thread records its decodes concurrently
+
+    # callback(name, seconds, nbytes) is called after every measured stage
+    def enable(self, callback=None):
+        self.callback = callback
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+        self.callback = None
+
+    def reset(self):
+        with self.lock:
+            self.stats = {}
+
+    def record(self, name, seconds, nbytes=0):
+        with self.lock:
+            stage = self.stats.get(name)
+            if stage is None:
+                stage = self.stats[name] = {"calls": 0, "seconds": 0.0, "bytes": 0}
+            stage["calls"] += 1
+            stage["seconds"] += seconds
+            stage["bytes"] += nbytes
+        if self.callback is not None:
+            self.callback(name, seconds, nbytes)
+
+    # copy of the stats, safe to keep while the profiler goes on measuring
+    def snapshot(self):
+        with self.lock:
+            return {name: dict(stage) for name, stage in self.stats.items()}
+
+    def report(self):
+        print(f"{'stage':<20}{'calls':>8}{'total (ms)':>14}{'mean (ms)':>12}{'MB allocated':>15}")
+        for name, stage in sorted(self.snapshot().items(), key=lambda item: -item[1]["seconds"]):
+            print(f"{name:<20}{stage['calls']:>8}{stage['seconds'] * 1e3:>14.3f}"
+                  f"{stage['seconds'] * 1e3 / stage['calls']:>12.3f}{stage['bytes'] / 2 ** 20:>15.2f}")
+
+profiler = Profiler()
+
+# with profile("row pass") as stage: ... stage.allocated(X.nbytes)
+def profile(name, nbytes=0):
+    if not profiler.enabled:
+        return _no_stage
+    return _Stage(name, nbytes)
+
+"""
+FFT plans: everything a transform of a given size needs that does not depend on the data
+(twiddle factors, bit-reversal indices, naive DFT matrix), computed once and kept in an LRU cache
+"""
+# the cache is bounded both by the number of plans and by the memory they hold
+plan_cache_max_plans = 64
+plan_cache_max_bytes = 256 * 2 ** 20
+
+class FFTPlan:
+    # N is the signal length, direction is "forward" or "inverse"
+    def __init__(self, N, direction, dtype=np.complex128):
+        self.N = N
+        self.direction = direction
+        self.dtype = np.dtype(dtype)
+        self.sign = -1 if direction == "forward" else 1
+        self.bit_reverse = None
+        self.twiddles = []
+        self.dft_matrix = None
+        self.real_twiddles = None
+        self.radix = None
+        self.dense = False
+        self.chirp = None
+        self.chirp_spectrum = None
+
+        if N > 0 and N & (N - 1) == 0:
+            # radix-2 stages: the full twiddle array of every stage size m = 2, 4, ..., N
+            self.bit_reverse = bit_reverse_indices(N)
+            m = 2
+            while m <= N:
+                e = np.exp((self.sign * 1j * 2 * np.pi * np.arange(m))/m)
+                self.twiddles.append(e.astype(self.dtype, copy=False))
+                m *= 2
+        elif N > 1:
+            self.radix = choose_radix(N)
+            if self.radix is not None:
+                # one mixed-radix step N = radix * M: the twiddles W_N^(r*k) with shape (M, radix)
+                # and the radix x radix DFT matrix that combines the sub-transforms
+                p = self.radix
+                k = np.arange(N // p).reshape((N // p, 1))
+                r = np.arange(p)
+                self.twiddles = [np.exp((self.sign * 1j * 2 * np.pi * r * k)/N).astype(self.dtype, copy=False)]
+                q = r.reshape((p, 1))
+                self.radix_matrix = np.exp((self.sign * 1j * 2 * np.pi * q * r)/p).astype(self.dtype, copy=False)
+            elif N <= dense_dft_max_len:
+                # a short length without a radix (a prime such as 41): one dense DFT matrix product
+                self.dense = True
+                self.build_dft_matrix()
+            else:
+                # Bluestein: the chirp w[n] = exp(sign*i*pi*n^2/N) and the FFT of the zero-padded conjugate chirp
+                # n^2 is taken modulo 2N so the exponent stays small for large N
+                L = next_fast_len(2 * N - 1)
+                n = np.arange(N)
+                self.chirp = np.exp((self.sign * 1j * np.pi * ((n * n) % (2 * N)))/N).astype(self.dtype, copy=False)
+                b = np.zeros(L, dtype=self.dtype)
+                b[:N] = np.conj(self.chirp)
+                b[L-N+1:] = np.conj(self.chirp[1:])[::-1]
+                self.chirp_spectrum = _FFT_any(b, "forward", out=np.empty(L, dtype=self.dtype))
+
+    # the N x N matrix of the naive DFT, only built when a naive transform asks for it
+    def build_dft_matrix(self):
+        if self.dft_matrix is None:
+            n = np.arange(self.N)
+            k = n.reshape((self.N, 1))
+            e = np.exp((self.sign * 1j * 2 * np.pi * k * n)/self.N)
+            self.dft_matrix = e.astype(self.dtype, copy=False)
+        return self.dft_matrix
+
+    # W_N^k for k = 0..N/2, used to split/merge the packed half-length transform of RFFT and IRFFT
+    def build_real_twiddles(self):
+        if self.real_twiddles is None:
+            k = np.arange(self.N // 2 + 1)
+            e = np.exp((self.sign * 1j * 2 * np.pi * k)/self.N)
+            self.real_twiddles = e.astype(self.dtype, copy=False)
+        return self.real_twiddles
+
+    @property
+    def nbytes(self):
+        total = sum(e.nbytes for e in self.twiddles)
+        if self.bit_reverse is not None:
+            total += self.bit_reverse.nbytes
+        if self.dft_matrix is not None:
+            total += self.dft_matrix.nbytes
+        if self.real_twiddles is not None:
+            total += self.real_twiddles.nbytes
+        if self.chirp is not None:
+            total += self.chirp.nbytes + self.chirp_spectrum.nbytes
+        return total
+
+class PlanCache:
+    def __init__(self, max_plans=plan_cache_max_plans, max_bytes=plan_cache_max_bytes):
+        self.max_plans = max_plans
+        self.max_bytes = max_bytes
+        self.plans = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # the 2D transforms can ask for plans from several threads (re-entrant: Bluestein plans get a radix-2 plan)
+        self.lock = threading.RLock()
+
+    # plan for (N, direction, dtype), created on a miss
+    # with dft_matrix=True the naive DFT matrix is built as well, with real=True the RFFT twiddles
+    def get(self, N, direction, dtype=np.complex128, dft_matrix=False, real=False):
+        key = (N, direction, np.dtype(dtype))
+        with self.lock:
+            plan = self.plans.get(key)
+            if plan is None:
+                self.misses += 1
+                plan = FFTPlan(N, direction, dtype)
+                self.plans[key] = plan
+            else:
+                self.hits += 1
+                self.plans.move_to_end(key)
+            if dft_matrix and plan.dft_matrix is None:
+                plan.build_dft_matrix()
+            if real and plan.real_twiddles is None:
+                plan.build_real_twiddles()
+            self.trim()
+        return plan
+
+    # evict least recently used plans until both limits hold (the newest plan is always kept)
+    def trim(self):
+        while len(self.plans) > 1 and (len(self.plans) > self.max_plans or self.nbytes > self.max_bytes):
+            self.plans.popitem(last=False)
+            self.evictions += 1
+
+    @property
+    def nbytes(self):
+        return sum(plan.nbytes for plan in self.plans.values())
+
+    def clear(self):
+        with self.lock:
+            self.plans.clear()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def info(self):
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "plans": len(self.plans), "bytes": self.nbytes,
+                "max_plans": self.max_plans, "max_bytes": self.max_bytes}
+
+plan_cache = PlanCache()
+
+def get_plan(N, direction, dtype=np.complex128, dft_matrix=False, real=False):
+    return plan_cache.get(N, direction, dtype, dft_matrix, real)
+
+# hit/miss counters and current size of the plan cache
+def plan_cache_info():
+    return plan_cache.info()
+
+def clear_plan_cache():
+    plan_cache.clear()
+
 """
 all definitions for different DFTs and FFTs
 """
@@ -47,11 +309,8 @@ all definitions for different DFTs and FFTs
 def DFT_naive(x):
     # length of signal x
     N = len(x)
-    # return evenly spaced values within a given interval
-    n = np.arange(N)
-    k = n.reshape((N, 1))
-    # DFT exponential part 
-    e = np.exp((-1j * 2 * np.pi * k * n)/N)
+    # DFT exponential part, the matrix exp(-2j*pi*k*n/N) comes from the plan cache
+    e = get_plan(N, "forward", dft_matrix=True).dft_matrix
     # the dot product
     X = np.dot(e, x)
     return X
@@ -59,280 +318,1332 @@ def DFT_naive(x):
 # Inverse DFT of a 1D signal value x
 def DFT_naive_inverse(x): 
     N = len(x)
-    # return evenly spaced values within a given interval
-    n = np.arange(N)
-    k = n.reshape((N, 1))
-    # DFT exponential part 
-    e = np.exp((1j * 2 * np.pi * k * n)/N)
+    # DFT exponential part, exp(2j*pi*k*n/N)
+    e = get_plan(N, "inverse", dft_matrix=True).dft_matrix
     # the dot product
     X = (np.dot(e, x)/N)
     return X
 
-# DFT of a 2D array
+# DFT of a 2D array as two dense matrix products F_M . y . F_N (the DFT matrices are symmetric)
+# both matrices come from the plan cache and the products run through BLAS, which makes this
+# a fast and simple reference to check the FFT against
 def DFT_naive_2D(y):
-    N = len(y)
-    M = len(y[0])
-    X = np.empty([N,M], dtype=complex)
-    for column in range(M):
-        X[:, column] = DFT_naive(X[:, column])
-    for row in range(N):
-        X[row, :] = DFT_naive(X[row, :])
-    
-    return X
+    M = len(y)
+    N = len(y[0])
+    F_M = get_plan(M, "forward", dft_matrix=True).dft_matrix
+    F_N = get_plan(N, "forward", dft_matrix=True).dft_matrix
+    return F_M @ (np.asarray(y) @ F_N)
+
+# inverse DFT of a 2D array
+def DFT_naive_2D_inverse(y):
+    M = len(y)
+    N = len(y[0])
+    F_M = get_plan(M, "inverse", dft_matrix=True).dft_matrix
+    F_N = get_plan(N, "inverse", dft_matrix=True).dft_matrix
+    return F_M @ (np.asarray(y) @ F_N) / (M * N)
 
 # https://pythonnumericalmethods.berkeley.edu/notebooks/chapter24.03-Fast-Fourier-Transform.html
-# 1D FFT with an input signal x of a length of power of 2
-def FFT(x):
-    N = len(x)
-    if N == 1:
-        return x
-    
-    n = np.arange(N) # n = evenly spaced values within the interval
-    X_even = FFT(x[0::2]) # recursively call FFT on the even inputs of x
-    X_odd = FFT(x[1::2]) # recursively call FFT on the odd inputs of x
+# https://en.wikipedia.org/wiki/Cooley%E2%80%93Tukey_FFT_algorithm#Data_reordering,_bit_reversal,_and_in-place_algorithms
+# indices 0..N-1 in bit-reversed order (N is a power of 2)
+# reading x in this order puts the even/odd splits of every level next to each other
+def bit_reverse_indices(N):
+    bits = N.bit_length() - 1
+    n = np.arange(N)
+    reversed_n = np.zeros(N, dtype=np.intp)
+    for b in range(bits):
+        reversed_n |= ((n >> b) & 1) << (bits - 1 - b)
+    return reversed_n
 
-    e = np.exp((-1j * 2 * np.pi * n)/N) # Math part
-    X = np.concatenate([X_even + e[:int(N/2)] * X_odd, X_even + e[int(N/2):] * X_odd])
-    return X
+# view of array a with the given axis split into (length/m, m), without copying
+# a reshape would silently copy when a is a non-contiguous view (e.g. a column block)
+def _split_axis(a, axis, m):
+    stride = a.strides[axis]
+    shape = a.shape[:axis] + (a.shape[axis] // m, m) + a.shape[axis+1:]
+    strides = a.strides[:axis] + (stride * m, stride) + a.strides[axis+1:]
+    return np.lib.stride_tricks.as_strided(a, shape, strides)
 
-# 1D inverse FFT with an input signal x of a length of power of 2
-def FFT_inverse(x):
-    N = len(x)
-    n = np.arange(N)
-  #  k = n.reshape((N, 1))
-    if N == 1:
-        return x
+# iterative radix-2 engine shared by FFT and FFT_inverse
+# direction is "forward" or "inverse" (unscaled), its twiddles and bit-reversal indices come from the plan cache
+# every signal along the given axis is transformed at once: each butterfly stage works on
+# a view of the output buffer where that axis is split into (N/m, m) blocks
+def _FFT_radix2(x, direction, axis=-1, out=None, dtype=np.complex128):
+    x = np.asarray(x)
+    axis = axis % x.ndim
+    N = x.shape[axis]
+    if N == 0 or N & (N - 1) != 0:
+        raise ValueError("FFT needs an input signal with a length of power of 2")
+    if out is None:
+        out = np.empty(x.shape, dtype=dtype)
+    elif out.shape != x.shape:
+        raise ValueError("out must have the same shape as the input signal")
+    plan = get_plan(N, direction, out.dtype)
+
+    # bit-reversal permutation along the axis straight into the output buffer
+    if out.dtype == x.dtype and not np.may_share_memory(out, x):
+        np.take(x, plan.bit_reverse, axis=axis, out=out, mode='clip')
     else:
-         X_even = FFT_inverse(x[::2])
-         X_odd = FFT_inverse(x[1::2])
-         e = np.exp((1j * 2 * np.pi * n)/N)
-         X = np.concatenate([X_even + e[:int(N/2)] * X_odd, X_even + e[int(N/2):] * X_odd])/N
-         return X
+        out[...] = np.take(x, plan.bit_reverse, axis=axis)
+
+    # scratch for the twiddled odd halves, allocated once per call (not per stage)
+    scratch_shape = x.shape[:axis] + (N // 2,) + x.shape[axis+1:]
+    scratch_low = np.empty(scratch_shape, dtype=out.dtype)
+    scratch_high = np.empty(scratch_shape, dtype=out.dtype)
+
+    # slices along the second of the two split axes and the twiddle shape that broadcasts against them
+    before = (slice(None),) * (axis + 1)
+    trailing = (1,) * (x.ndim - axis - 1)
+
+    for e in plan.twiddles:
+        m = len(e)
+        half = m // 2
+        # same twiddles as the recursive version: the first half for X[k], the second half for X[k + m/2]
+        e = e.reshape((m,) + trailing)
+        blocks = _split_axis(out, axis, m)
+        X_even = blocks[before + (slice(0, half),)]
+        X_odd = blocks[before + (slice(half, m),)]
+        low = _split_axis(scratch_low, axis, half)
+        high = _split_axis(scratch_high, axis, half)
+        np.multiply(e[:half], X_odd, out=low)
+        np.multiply(e[half:], X_odd, out=high)
+        np.add(X_even, high, out=X_odd)
+        np.add(X_even, low, out=X_even)
+
+    return out
+
+# lengths without a radix up to this size are transformed with a dense DFT matrix instead of Bluestein
+dense_dft_max_len = 64
+# the primes that can be split off as a mixed-radix step, above 5 the step combines with a matrix product
+small_primes = (5, 3, 7, 11, 13, 17, 19, 23, 29, 31, 37, 41, 43, 47, 53, 59, 61)
+
+# radix used to split a length N that is not a power of 2, or None when N is short enough for a dense DFT
+# or when only Bluestein is left
+# 5 and 3 go first so the remaining power of 2 is left to the radix-2 engine,
+# 4 and 2 are only split off when the rest has another prime factor (then that factor is a shorter transform)
+# the other small primes are split off as long as something is left to transform after them
+def choose_radix(N):
+    for p in (5, 3, 4, 2):
+        if N % p == 0:
+            return p
+    if N > dense_dft_max_len:
+        for p in small_primes[2:]:
+            if N % p == 0:
+                return p
+    return None
+
+# sizes that are products of 2, 3 and 5 only never need Bluestein
+def is_fast_len(N):
+    for p in (2, 3, 5):
+        while N % p == 0:
+            N //= p
+    return N == 1
+
+# smallest fast size >= N, the size to zero-pad to
+def next_fast_len(N):
+    while not is_fast_len(N):
+        N += 1
+    return N
+
+# https://en.wikipedia.org/wiki/Cooley%E2%80%93Tukey_FFT_algorithm#General_factorizations
+# one decimation-in-time step with N = p * M: x[p*j + r] is transformed along j for every r at once,
+# the results are twiddled by W_N^(r*k) and combined by a p-point DFT into X[k + M*q]
+def _FFT_mixed_radix(x, plan, axis, out):
+    p = plan.radix
+    M = plan.N // p
+    # (M, p) view of the axis: element [j, r] is x[p*j + r]
+    Y = _FFT_any(_split_axis(x, axis, p), plan.direction, axis, dtype=out.dtype)
+    trailing = (1,) * (x.ndim - axis - 1)
+    Y *= plan.twiddles[0].reshape((M, p) + trailing)
+
+    # (p, M) view of the output: element [q, k] is X[k + M*q]
+    X = _split_axis(out, axis, M)
+    if p > 5:
+        # X[q, k] = sum over r of radix_matrix[q, r] * Y[k, r], as one matrix product over the last two axes
+        X = np.moveaxis(X, (axis, axis + 1), (-1, -2))
+        np.matmul(np.moveaxis(Y, (axis, axis + 1), (-2, -1)), plan.radix_matrix.T, out=X)
+        return out
+    before = (slice(None),) * axis
+    Y_r = [Y[before + (slice(None), r)] for r in range(p)]
+    for q in range(p):
+        X_q = X[before + (q,)]
+        X_q[...] = Y_r[0]
+        for r in range(1, p):
+            X_q += plan.radix_matrix[q, r] * Y_r[r]
+    return out
+
+# a short transform as one product with the N x N DFT matrix of the plan (symmetric, so no transpose)
+def _FFT_dense(x, plan, axis, out):
+    np.matmul(np.moveaxis(x, axis, -1), plan.dft_matrix, out=np.moveaxis(out, axis, -1))
+    return out
+
+# https://en.wikipedia.org/wiki/Chirp_Z-transform#Bluestein's_algorithm
+# a DFT of any length N written as a convolution with a chirp, done with FFTs of a fast length L >= 2N - 1
+def _FFT_bluestein(x, plan, axis, out):
+    N = plan.N
+    L = len(plan.chirp_spectrum)
+    trailing = (1,) * (x.ndim - axis - 1)
+    before = (slice(None),) * axis
+    chirp = plan.chirp.reshape((N,) + trailing)
+
+    a = np.zeros(x.shape[:axis] + (L,) + x.shape[axis+1:], dtype=out.dtype)
+    np.multiply(x, chirp, out=a[before + (slice(0, N),)])
+    a = _FFT_any(a, "forward", axis, dtype=out.dtype)
+    a *= plan.chirp_spectrum.reshape((L,) + trailing)
+    a = _FFT_any(a, "inverse", axis, dtype=out.dtype)
+    np.multiply(a[before + (slice(0, N),)], chirp, out=out)
+    out /= L
+    return out
+
+# unscaled transform of any length along the given axis
+# powers of 2 go to the radix-2 engine, other lengths are split by choose_radix down to a power of 2,
+# a short length for a dense DFT, or Bluestein
+def _FFT_any(x, direction, axis=-1, out=None, dtype=np.complex128):
+    x = np.asarray(x)
+    axis = axis % x.ndim
+    N = x.shape[axis]
+    if N == 0:
+        raise ValueError("FFT needs a non-empty input signal")
+    if N & (N - 1) == 0:
+        return _FFT_radix2(x, direction, axis, out, dtype)
+    if out is None:
+        out = np.empty(x.shape, dtype=dtype)
+    elif out.shape != x.shape:
+        raise ValueError("out must have the same shape as the input signal")
+    plan = get_plan(N, direction, out.dtype)
+    if plan.radix is not None:
+        return _FFT_mixed_radix(x, plan, axis, out)
+    if plan.dense:
+        return _FFT_dense(x, plan, axis, out)
+    return _FFT_bluestein(x, plan, axis, out)
+
+# 1D FFT of an input signal x of any length
+# for an array, every signal along the given axis is transformed in one batched pass
+# the result is written into out when it is given (a complex array of the same shape, may be x itself)
+# dtype is the precision of the result and of every intermediate step when out is not given:
+# np.complex128 (default) or np.complex64 (single precision, see single_precision_bound)
+def FFT(x, axis=-1, out=None, dtype=np.complex128):
+    return _FFT_any(x, "forward", axis, out, dtype)
+
+# 1D inverse FFT of an input signal x of any length
+def FFT_inverse(x, axis=-1, out=None, dtype=np.complex128):
+    X = _FFT_any(x, "inverse", axis, out, dtype)
+    X /= X.shape[axis]
+    return X
+
+# https://www.fftw.org/accuracy/method.html
+# The error of an FFT grows like O(eps * log2(N)) (eps = 1.2e-7 for float32 and 2.2e-16 for float64).
+# The relative RMS error of the single precision path against the double precision one,
+# ||X32 - X64|| / ||X64||, stays below this bound; check_single_precision measures it
+def single_precision_bound(N):
+    return 2 * float(np.finfo(np.float32).eps) * max(1.0, float(np.log2(N)))
+
+# measured relative RMS error of the single precision FFT against the double precision one, with its bound
+def check_single_precision(sizes=(2 ** 5, 2 ** 10, 1000, 1025, 2 ** 16), seed=0):
+    random = np.random.default_rng(seed)
+    results = []
+    for N in sizes:
+        x = random.random(N) + 1j * random.random(N)
+        X64 = FFT(x)
+        X32 = FFT(x.astype(np.complex64), dtype=np.complex64)
+        error = float(np.linalg.norm(X32 - X64) / np.linalg.norm(X64))
+        results.append({"size": N, "error": error, "bound": single_precision_bound(N), "ok": bool(error <= single_precision_bound(N))})
+    return results
+
+# float dtype with the precision of a complex dtype
+def _real_dtype(dtype):
+    return np.finfo(np.dtype(dtype)).dtype
    
-# FFT of a 2D array
-def FFT_2D(image: np.ndarray):
+"""
+multi-core 2D transforms: the row pass and the column pass are split into blocks of rows
+(then columns) that run on a shared thread pool. The NumPy kernels release the GIL, so threads
+work on the same buffers in parallel without copying or pickling the image
+"""
+_pool = None
+_pool_workers = 0
+_pool_lock = threading.Lock()
 
-    M = len(image)
-    N = len(image[0])
-    X = np.zeros([M,N], dtype='complex_')
+# the shared pool, created on first use and only replaced when more workers are asked for
+def get_pool(workers):
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is None or _pool_workers < workers:
+            from concurrent.futures import ThreadPoolExecutor # only needed once a pool is used
+            if _pool is not None:
+                _pool.shutdown(wait=False)
+            _pool = ThreadPoolExecutor(max_workers=workers)
+            _pool_workers = workers
+        return _pool
 
-    for i, row in enumerate(image): # call the FFT on each row of image
-        X[i] = FFT(row)
+# workers=None means one per core
+def _resolve_workers(workers):
+    if workers is None:
+        return os.cpu_count() or 1
+    return max(1, int(workers))
 
-    X2 = np.zeros([N,M], dtype='complex_')
-    for i, col in enumerate(X.T): # call the FFT on each column of image
-        X2[i] = FFT(col)
+# calls function(start, stop) on about `workers` contiguous blocks of range(length) and waits for all of them
+def run_blocks(function, length, workers):
+    workers = min(_resolve_workers(workers), length)
+    if workers <= 1:
+        function(0, length)
+        return
+    bounds = np.linspace(0, length, workers + 1).astype(int)
+    pool = get_pool(workers)
+    futures = [pool.submit(function, bounds[i], bounds[i + 1]) for i in range(workers)]
+    for future in futures:
+        future.result() # re-raises an exception from the block
 
-    return X2.T
+# FFT of a 2D array
+# all rows are transformed in one batched pass, then all columns in place in the same buffer
+# with workers > 1 (None for all cores) each pass is split into blocks run on the thread pool
+def FFT_2D(image: np.ndarray, workers=1, dtype=np.complex128):
+    if _resolve_workers(workers) == 1:
+        with profile("row pass") as stage:
+            X = FFT(image, axis=1, dtype=dtype)
+            stage.allocated(X.nbytes)
+        with profile("column pass"):
+            return FFT(X, axis=0, out=X)
+    X = np.empty(np.shape(image), dtype=dtype)
+    with profile("row pass", X.nbytes):
+        run_blocks(lambda a, b: FFT(image[a:b], axis=1, out=X[a:b]), X.shape[0], workers)
+    with profile("column pass"):
+        run_blocks(lambda a, b: FFT(X[:, a:b], axis=0, out=X[:, a:b]), X.shape[1], workers)
+    return X
 
 # inverse FFT of a 2D array
-def FFT_2D_inverse(y):
-    M = len(y)
-    N = len(y[0])
-    X = np.empty([M,N], dtype='complex_')
-    for i, row in enumerate(y): # apply the FFT_inverse on each row of image y
-        X[i] = FFT_inverse(row)
+def FFT_2D_inverse(y, workers=1, dtype=np.complex128):
+    if _resolve_workers(workers) == 1:
+        with profile("inverse row pass") as stage:
+            X = FFT_inverse(y, axis=1, dtype=dtype)
+            stage.allocated(X.nbytes)
+        with profile("inverse column pass"):
+            return FFT_inverse(X, axis=0, out=X)
+    X = np.empty(np.shape(y), dtype=dtype)
+    with profile("inverse row pass", X.nbytes):
+        run_blocks(lambda a, b: FFT_inverse(y[a:b], axis=1, out=X[a:b]), X.shape[0], workers)
+    with profile("inverse column pass"):
+        run_blocks(lambda a, b: FFT_inverse(X[:, a:b], axis=0, out=X[:, a:b]), X.shape[1], workers)
+    return X
+
+"""
+Out-of-core 2D FFT for images larger than RAM: the input is read and the spectrum written through np.memmap.
+The row pass runs on strips of rows and the column pass on strips of columns of the output file, so only
+one strip (plus the transform's temporaries) is in memory at a time, whatever the image size
+"""
+default_memory_budget = 256 * 2 ** 20
+# approximate bytes of RAM per element of a strip: the complex strip, the FFT scratch and the temporary copies
+memmap_bytes_per_element = 64
 
-    X2 = np.empty([N,M], dtype='complex_')
-    for i, col in enumerate(X.T): # apply the FFT_inverse on each column of image y
-        X2[i] = FFT_inverse(col)
+# the input can be an array, a memmap or the path of a .npy file (then opened memory-mapped)
+def _open_input(source):
+    if isinstance(source, (str, os.PathLike)):
+        return np.load(source, mmap_mode='r')
+    return source
 
-    return X2.T
+# 2D FFT (or inverse) from source to a new .npy file at output_path, returned as a memmap
+# memory_budget (bytes) sets the strip sizes and so the peak RAM of the transform
+def FFT_2D_memmap(source, output_path, memory_budget=default_memory_budget, inverse=False, dtype=np.complex128):
+    x = _open_input(source)
+    M, N = x.shape
+    transform = FFT_inverse if inverse else FFT
+    out = np.lib.format.open_memmap(output_path, mode='w+', dtype=dtype, shape=(M, N))
+
+    # row pass: strips of full rows, contiguous in both files
+    rows = max(1, memory_budget // (N * memmap_bytes_per_element))
+    for a in range(0, M, rows):
+        strip = np.array(x[a:a + rows], dtype=dtype)
+        out[a:a + rows] = transform(strip, axis=1, out=strip)
+    out.flush()
+
+    # column pass: strips of columns read from and written back to the output file
+    columns = max(1, memory_budget // (M * memmap_bytes_per_element))
+    for a in range(0, N, columns):
+        strip = np.array(out[:, a:a + columns])
+        out[:, a:a + columns] = transform(strip, axis=0, out=strip)
+    out.flush()
+    return out
+
+# inverse of FFT_2D_memmap, its output file (or memmap) can be passed directly as source
+def FFT_2D_inverse_memmap(source, output_path, memory_budget=default_memory_budget, dtype=np.complex128):
+    return FFT_2D_memmap(source, output_path, memory_budget, inverse=True, dtype=dtype)
 
 """
-adjusting and resizing the input image if necessary (not power of two already)
+real-input FFT: a real signal of even length N is packed into a complex signal of length N/2
+(even samples as the real part, odd samples as the imaginary part), transformed, and split back.
+Only the non-redundant half X[0..N/2] of the Hermitian spectrum is stored
 """
-def resizeImg(img):
-    image = cv2.imread(img,cv2.IMREAD_GRAYSCALE)
-    height = len(image)
-    width = len(image[0])
+# https://www.robinscheibler.org/2013/02/13/real-fft.html
+# FFT of a real signal along the given axis, returns the N//2 + 1 non-negative frequencies
+def RFFT(x, axis=-1, dtype=np.complex128):
+    x = np.asarray(x)
+    axis = axis % x.ndim
+    N = x.shape[axis]
+    before = (slice(None),) * axis
+    if N % 2 == 1:
+        # odd lengths cannot be packed in pairs, take the half of the complex transform
+        return FFT(x, axis, dtype=dtype)[before + (slice(0, N // 2 + 1),)]
 
-    if height != 2 ** (int(np.log2(height))):
-        height = 2 ** (int(np.log2(height))+1)
+    half = N // 2
+    z = np.empty(x.shape[:axis] + (half,) + x.shape[axis+1:], dtype=dtype)
+    z.real = x[before + (slice(0, None, 2),)]
+    z.imag = x[before + (slice(1, None, 2),)]
+    Z = FFT(z, axis, out=z)
 
-    if width != 2 ** (int(np.log2(width))):
-        width = 2 ** (int(np.log2(width))+1)
-    final_image = cv2.resize(image,(width,height))
-   
+    # Z[k] and conj(Z[N/2 - k]) for k = 0..N/2 (with Z[N/2] = Z[0])
+    k = np.arange(half + 1)
+    Z_k = np.take(Z, k % half, axis=axis)
+    Z_mirror = np.conj(np.take(Z, (half - k) % half, axis=axis))
+    # spectra of the even samples and of the odd samples
+    E = (Z_k + Z_mirror) / 2
+    O = (Z_k - Z_mirror) * -0.5j
+    W = get_plan(N, "forward", z.dtype, real=True).real_twiddles.reshape((half + 1,) + (1,) * (x.ndim - axis - 1))
+    E += W * O
+    return E
+
+# inverse of RFFT: a real signal of length n (default 2*(m-1)) from its m non-negative frequencies
+def IRFFT(X, n=None, axis=-1, dtype=np.complex128):
+    X = np.asarray(X)
+    axis = axis % X.ndim
+    if n is None:
+        n = 2 * (X.shape[axis] - 1)
+    before = (slice(None),) * axis
+    half = n // 2
+
+    # keep exactly n//2 + 1 frequencies, zero-padding a spectrum that is too short
+    m = min(X.shape[axis], half + 1)
+    spectrum = np.zeros(X.shape[:axis] + (half + 1,) + X.shape[axis+1:], dtype=dtype)
+    spectrum[before + (slice(0, m),)] = X[before + (slice(0, m),)]
+
+    if n % 2 == 1:
+        # odd lengths: rebuild the full Hermitian spectrum and take the complex inverse
+        full = np.concatenate([spectrum, np.conj(np.flip(spectrum[before + (slice(1, None),)], axis=axis))], axis=axis)
+        return FFT_inverse(full, axis, out=full).real
+
+    # E[k] and O[k] (spectra of the even and odd samples) from X[k] and conj(X[N/2 - k])
+    k = np.arange(half)
+    X_k = spectrum[before + (slice(0, half),)]
+    X_mirror = np.conj(np.take(spectrum, half - k, axis=axis))
+    W = get_plan(n, "inverse", spectrum.dtype, real=True).real_twiddles[:half].reshape((half,) + (1,) * (X.ndim - axis - 1))
+    E = (X_k + X_mirror) / 2
+    O = (X_k - X_mirror) * W / 2
+    # pack them back into Z = E + iO and undo the half-length transform
+    E += 1j * O
+    z = FFT_inverse(E, axis, out=E)
+
+    x = np.empty(X.shape[:axis] + (n,) + X.shape[axis+1:], dtype=_real_dtype(dtype))
+    x[before + (slice(0, None, 2),)] = z.real
+    x[before + (slice(1, None, 2),)] = z.imag
+    return x
+
+# 2D FFT of a real image: RFFT along the rows, then a complex FFT of the (M, N//2 + 1) half-spectrum along the columns
+def RFFT_2D(image: np.ndarray, workers=1, dtype=np.complex128):
+    if _resolve_workers(workers) == 1:
+        with profile("row pass") as stage:
+            X = RFFT(image, axis=1, dtype=dtype)
+            stage.allocated(X.nbytes)
+        with profile("column pass"):
+            return FFT(X, axis=0, out=X)
+    M, N = np.shape(image)
+    X = np.empty((M, N // 2 + 1), dtype=dtype)
+    def rows(a, b):
+        X[a:b] = RFFT(image[a:b], axis=1, dtype=dtype)
+    with profile("row pass", X.nbytes):
+        run_blocks(rows, M, workers)
+    with profile("column pass"):
+        run_blocks(lambda a, b: FFT(X[:, a:b], axis=0, out=X[:, a:b]), X.shape[1], workers)
+    return X
+
+# inverse of RFFT_2D, shape is the (M, N) shape of the original image (N defaults to an even width)
+def IRFFT_2D(y, shape=None, workers=1, dtype=np.complex128):
+    n = 2 * (y.shape[1] - 1) if shape is None else shape[1]
+    if _resolve_workers(workers) == 1:
+        with profile("inverse column pass") as stage:
+            X = FFT_inverse(y, axis=0, dtype=dtype)
+            stage.allocated(X.nbytes)
+        with profile("inverse row pass") as stage:
+            x = IRFFT(X, n, axis=1, dtype=dtype)
+            stage.allocated(x.nbytes)
+        return x
+    X = np.empty(y.shape, dtype=dtype)
+    with profile("inverse column pass", X.nbytes):
+        run_blocks(lambda a, b: FFT_inverse(y[:, a:b], axis=0, out=X[:, a:b]), X.shape[1], workers)
+    x = np.empty((y.shape[0], n), dtype=_real_dtype(dtype))
+    def rows(a, b):
+        x[a:b] = IRFFT(X[a:b], n, axis=1, dtype=dtype)
+    with profile("inverse row pass", x.nbytes):
+        run_blocks(rows, x.shape[0], workers)
+    return x
+
+# full (M, N) spectrum from the half-spectrum of RFFT_2D using X[m, N - c] = conj(X[-m, c])
+def half_to_full_spectrum(X_half, N):
+    M = X_half.shape[0]
+    full = np.empty((M, N), dtype=X_half.dtype)
+    width = X_half.shape[1]
+    full[:, :width] = X_half
+    rows = (-np.arange(M)) % M
+    columns = np.arange(width, N)
+    full[:, width:] = np.conj(X_half[rows][:, N - columns])
+    return full
+
+# number of non-zero coefficients the full spectrum would have, counted on the half-spectrum:
+# every column except 0 (and N/2 when N is even) also appears mirrored in the other half
+def count_nonzero_full(X_half, N):
+    weights = np.full(X_half.shape[1], 2)
+    weights[0] = 1
+    if N % 2 == 0:
+        weights[-1] = 1
+    return int((np.count_nonzero(X_half, axis=0) * weights).sum())
+
+"""
+FFT convolution of long 1D signals and large images with block-wise overlap-add or overlap-save.
+The signal is cut into blocks that are convolved with the kernel through FFTs of a fixed size chosen from
+the kernel size, so memory is bounded by the block size; the kernel spectrum is cached across blocks and calls
+"""
+kernel_cache_max_entries = 32
+# 1D blocks are transformed in batches of at most this many bytes
+convolution_batch_bytes = 16 * 2 ** 20
+# smallest 2D tile side: every tile costs a few Python-level transforms, so small tiles are dominated by overhead
+convolution_min_tile = 256
+# kernels with at most this many taps are convolved directly (one vectorized shift-and-add per tap),
+# which is cheaper than any FFT tiling for them
+convolution_direct_taps = 81
+
+_kernel_spectra = OrderedDict()
+_kernel_spectra_lock = threading.Lock()
+
+# FFT length for a kernel of length K: a power of 2 several times longer than the kernel,
+# so each block does useful work while the FFT stays small (never longer than the whole output needs)
+def choose_fft_length(K, n, factor=8, minimum=64):
+    L = 2 ** int(np.ceil(np.log2(max(factor * K, minimum))))
+    return min(L, next_fast_len(n + K - 1))
+
+# spectrum of the kernel zero-padded to fft_shape (RFFT of the last axis when real), cached per kernel and shape
+def kernel_spectrum(kernel, fft_shape, real):
+    kernel = np.asarray(kernel)
+    key = (kernel.tobytes(), kernel.shape, kernel.dtype.str, tuple(fft_shape), real)
+    with _kernel_spectra_lock:
+        spectrum = _kernel_spectra.get(key)
+        if spectrum is not None:
+            _kernel_spectra.move_to_end(key)
+            return spectrum
+    padded = np.zeros(fft_shape, dtype=float if real else np.complex128)
+    padded[tuple(slice(0, k) for k in kernel.shape)] = kernel
+    spectrum = RFFT(padded, axis=-1) if real else FFT(padded, axis=-1)
+    for axis in range(padded.ndim - 1):
+        FFT(spectrum, axis=axis, out=spectrum)
+    with _kernel_spectra_lock:
+        _kernel_spectra[key] = spectrum
+        while len(_kernel_spectra) > kernel_cache_max_entries:
+            _kernel_spectra.popitem(last=False)
+    return spectrum
+
+# crops a full convolution to the "same" size as the input, centered like numpy.convolve
+def _crop_same(full, input_shape, kernel_shape):
+    return full[tuple(slice((k - 1) // 2, (k - 1) // 2 + n) for n, k in zip(input_shape, kernel_shape))]
+
+# circular convolution of every row of blocks (shape (B, L)) with the kernel spectrum H
+def _convolve_blocks(blocks, H, L, real):
+    if real:
+        return IRFFT(RFFT(blocks, axis=-1) * H, L, axis=-1)
+    Y = FFT(blocks, axis=-1)
+    Y *= H
+    return FFT_inverse(Y, axis=-1, out=Y)
+
+# 1D convolution of x with kernel, method is "overlap-add" or "overlap-save"
+# block is the number of input (overlap-add) or output (overlap-save) samples per FFT, chosen from the kernel when None
+# mode "full" returns len(x) + len(kernel) - 1 samples, "same" returns len(x) samples
+def fft_convolve(x, kernel, method="overlap-add", block=None, mode="full"):
+    x = np.asarray(x)
+    kernel = np.asarray(kernel)
+    n, K = len(x), len(kernel)
+    if n == 0 or K == 0:
+        raise ValueError("fft_convolve needs a non-empty signal and kernel")
+    real = not (np.iscomplexobj(x) or np.iscomplexobj(kernel))
+    # block + K - 1 samples per FFT, with the tail of a block shorter than the next block (K - 1 <= block)
+    L = choose_fft_length(K, n) if block is None else next_fast_len(block + K - 1)
+    L = max(L, 2 * K - 1)
+    B = L - K + 1
+    H = kernel_spectrum(kernel, (L,), real)
+    length = n + K - 1
+    blocks_per_batch = max(1, convolution_batch_bytes // (L * 16))
+    out = np.zeros(length, dtype=float if real else np.complex128)
+
+    if method == "overlap-add":
+        count = -(-n // B)
+        for first in range(0, count, blocks_per_batch):
+            last = min(count, first + blocks_per_batch)
+            # zero-padded input blocks x[i*B : (i+1)*B] of length L
+            segment = x[first * B : last * B]
+            blocks = np.zeros((last - first, L), dtype=out.dtype)
+            heads = np.zeros((last - first) * B, dtype=out.dtype)
+            heads[:len(segment)] = segment
+            blocks[:, :B] = heads.reshape(last - first, B)
+            y = _convolve_blocks(blocks, H, L, real)
+            # every block adds L samples starting at its own position: B new ones and a K - 1 tail
+            # that overlaps the start of the next block (K - 1 < B, so tails never overlap each other)
+            count_batch = last - first
+            added = np.zeros((count_batch + 1, B), dtype=out.dtype)
+            added[:count_batch] = y[:, :B]
+            added[1:, :K - 1] += y[:, B:]
+            start = first * B
+            stop = min(length, start + added.size)
+            out[start:stop] += added.reshape(-1)[:stop - start]
+    elif method == "overlap-save":
+        # input with K - 1 zeros in front (history of the first block) and enough zeros at the end
+        count = -(-length // B)
+        padded = np.zeros(K - 1 + count * B + K - 1, dtype=out.dtype)
+        padded[K - 1:K - 1 + n] = x
+        for first in range(0, count, blocks_per_batch):
+            last = min(count, first + blocks_per_batch)
+            # overlapping windows padded[i*B : i*B + L], read as a strided view
+            windows = np.lib.stride_tricks.as_strided(padded[first * B:], (last - first, L), (B * padded.strides[0], padded.strides[0]))
+            y = _convolve_blocks(windows, H, L, real)
+            # the first K - 1 samples of every block are wrapped around, the last B are valid output
+            start = first * B
+            stop = min(length, last * B)
+            out[start:stop] = y[:, K - 1:].reshape(-1)[:stop - start]
+    else:
+        raise ValueError("method must be overlap-add or overlap-save")
+
+    if mode == "same":
+        return _crop_same(out, (n,), (K,))
+    return out
+
+# direct 2D convolution, one shifted multiply-add of the whole image per kernel tap
+def _convolve_direct_2D(image, kernel, out):
+    M, N = image.shape
+    for a in range(kernel.shape[0]):
+        for b in range(kernel.shape[1]):
+            out[a:a + M, b:b + N] += kernel[a, b] * image
+
+# 2D convolution of an image with a kernel, tile by tile (tiles of block = (rows, columns), chosen from the kernel when None)
+# method="auto" convolves small kernels (up to convolution_direct_taps taps) directly and the others with overlap-add
+def fft_convolve_2D(image, kernel, method="auto", block=None, mode="full"):
+    image = np.asarray(image)
+    kernel = np.asarray(kernel)
+    (M, N), (Km, Kn) = image.shape, kernel.shape
+    real = not (np.iscomplexobj(image) or np.iscomplexobj(kernel))
+    shape = (M + Km - 1, N + Kn - 1)
+    if method == "auto":
+        method = "direct" if Km * Kn <= convolution_direct_taps and block is None else "overlap-add"
+    if method == "direct":
+        out = np.zeros(shape, dtype=float if real else np.complex128)
+        _convolve_direct_2D(image, kernel, out)
+        return _crop_same(out, (M, N), (Km, Kn)) if mode == "same" else out
+    if block is None:
+        Lm = choose_fft_length(Km, M, 4, convolution_min_tile)
+        Ln = choose_fft_length(Kn, N, 4, convolution_min_tile)
+    else:
+        Lm, Ln = next_fast_len(block[0] + Km - 1), next_fast_len(block[1] + Kn - 1)
+    Bm, Bn = Lm - Km + 1, Ln - Kn + 1
+    H = kernel_spectrum(kernel, (Lm, Ln), real)
+    out = np.zeros(shape, dtype=float if real else np.complex128)
+
+    def convolve_tile(tile):
+        if real:
+            return IRFFT_2D(RFFT_2D(tile) * H, (Lm, Ln))
+        Y = FFT_2D(tile)
+        Y *= H
+        return FFT_2D_inverse(Y)
+
+    tile = np.zeros((Lm, Ln), dtype=out.dtype)
+    if method == "overlap-add":
+        for i in range(0, M, Bm):
+            for j in range(0, N, Bn):
+                part = image[i:i + Bm, j:j + Bn]
+                tile[...] = 0
+                tile[:part.shape[0], :part.shape[1]] = part
+                y = convolve_tile(tile)
+                rows, columns = min(Lm, shape[0] - i), min(Ln, shape[1] - j)
+                out[i:i + rows, j:j + columns] += y[:rows, :columns]
+    elif method == "overlap-save":
+        padded = np.zeros((Km - 1 + shape[0] + Lm, Kn - 1 + shape[1] + Ln), dtype=out.dtype)
+        padded[Km - 1:Km - 1 + M, Kn - 1:Kn - 1 + N] = image
+        for i in range(0, shape[0], Bm):
+            for j in range(0, shape[1], Bn):
+                y = convolve_tile(padded[i:i + Lm, j:j + Ln])
+                rows, columns = min(Bm, shape[0] - i), min(Bn, shape[1] - j)
+                out[i:i + rows, j:j + columns] = y[Km - 1:Km - 1 + rows, Kn - 1:Kn - 1 + columns]
+    else:
+        raise ValueError("method must be auto, direct, overlap-add or overlap-save")
+
+    if mode == "same":
+        return _crop_same(out, (M, N), (Km, Kn))
+    return out
+
+"""
+Short-time Fourier transform (spectrograms) of 1D signals built on the batched FFT: every frame of a
+signal is windowed and all the frames are transformed at once. StreamingSTFT gives the same frames from
+chunks of a stream as soon as they are complete, and SlidingDFT updates every bin in O(N) per sample (hop 1)
+"""
+# periodic window of length N (name or an array of length N)
+def get_window(window, N):
+    if not isinstance(window, str):
+        window = np.asarray(window, dtype=float)
+        if window.shape != (N,):
+            raise ValueError("the window must have the length of a segment")
+        return window
+    n = np.arange(N)
+    if window in ("rect", "boxcar"):
+        return np.ones(N)
+    if window == "hann":
+        return 0.5 - 0.5 * np.cos(2 * np.pi * n / N)
+    if window == "hamming":
+        return 0.54 - 0.46 * np.cos(2 * np.pi * n / N)
+    if window == "blackman":
+        return 0.42 - 0.5 * np.cos(2 * np.pi * n / N) + 0.08 * np.cos(4 * np.pi * n / N)
+    raise ValueError("unknown window " + window)
+
+def _default_hop(nperseg, hop):
+    hop = nperseg // 2 if hop is None else hop
+    if not 0 < hop <= nperseg:
+        raise ValueError("hop must be between 1 and the segment length")
+    return max(1, hop)
+
+# spectra of the frames of x, shape (frames, nperseg); frame i starts at sample i * hop - (nperseg - hop),
+# the signal is zero-padded in front and at the end so every sample is covered by the same number of frames
+def STFT(x, window="hann", nperseg=256, hop=None):
+    x = np.asarray(x)
+    hop = _default_hop(nperseg, hop)
+    w = get_window(window, nperseg)
+    front = nperseg - hop
+    count = max(1, -(-(len(x) + front - nperseg) // hop) + 1)
+    padded = np.zeros(front + len(x) + (count - 1) * hop + nperseg, dtype=x.dtype)
+    padded[front:front + len(x)] = x
+    frames = np.lib.stride_tricks.sliding_window_view(padded, nperseg)[::hop][:count]
+    return FFT(frames * w, axis=-1)
+
+# inverse of STFT by weighted overlap-add, length is the length of the original signal
+# real=True returns the real part (for spectra of real signals)
+def ISTFT(S, window="hann", nperseg=None, hop=None, length=None, real=True):
+    S = np.asarray(S)
+    nperseg = S.shape[-1] if nperseg is None else nperseg
+    hop = _default_hop(nperseg, hop)
+    w = get_window(window, nperseg)
+    frames = FFT_inverse(S, axis=-1) * w
+    count = len(frames)
+    total = (count - 1) * hop + nperseg
+    signal = np.zeros(total, dtype=frames.dtype)
+    weight = np.zeros(total)
+    for i in range(count):
+        signal[i * hop:i * hop + nperseg] += frames[i]
+        weight[i * hop:i * hop + nperseg] += w * w
+    # the window sum is only 0 where no frame contributes (or the window itself is 0 there, e.g. hann with hop = nperseg)
+    signal /= np.where(weight > 1e-10, weight, 1.0)
+    front = nperseg - hop
+    signal = signal[front:] if length is None else signal[front:front + length]
+    return signal.real if real else signal
+
+# STFT of a stream: feed() buffers a chunk right away and returns the spectra of the frames it completes,
+# flush() pads the end of the stream with zeros and returns the last frames (same frames as STFT of the whole signal)
+# both return a (frames, nperseg) array, with no rows when no frame is complete yet
+# stream() is the generator interface: it consumes an iterable of chunks and yields every frame as it completes
+class StreamingSTFT:
+    def __init__(self, window="hann", nperseg=256, hop=None):
+        self.nperseg = nperseg
+        self.hop = _default_hop(nperseg, hop)
+        self.window = get_window(window, nperseg)
+        self.buffer = np.zeros(nperseg - self.hop)
+        self.received = 0
+
+    def feed(self, chunk):
+        chunk = np.asarray(chunk)
+        self.received += len(chunk)
+        self.buffer = np.concatenate([self.buffer, chunk])
+        if len(self.buffer) < self.nperseg:
+            return np.empty((0, self.nperseg), dtype=np.complex128)
+        # all the complete frames of this chunk are transformed in one batched FFT
+        count = (len(self.buffer) - self.nperseg) // self.hop + 1
+        frames = np.lib.stride_tricks.sliding_window_view(self.buffer, self.nperseg)[::self.hop][:count]
+        spectra = FFT(frames * self.window, axis=-1)
+        self.buffer = self.buffer[count * self.hop:]
+        return spectra
+
+    def flush(self):
+        # frames still to come cover up to the last received sample
+        front = self.nperseg - self.hop
+        total = max(1, -(-(self.received + front - self.nperseg) // self.hop) + 1)
+        emitted = (front + self.received - len(self.buffer)) // self.hop
+        missing = total - emitted
+        spectra = np.empty((0, self.nperseg), dtype=np.complex128)
+        if missing > 0:
+            padding = (missing - 1) * self.hop + self.nperseg - len(self.buffer)
+            spectra = self.feed(np.zeros(max(0, padding)))
+        self.buffer = np.zeros(front)
+        self.received = 0
+        return spectra
+
+    def stream(self, chunks):
+        for chunk in chunks:
+            yield from self.feed(chunk)
+        yield from self.flush()
+
+# https://en.wikipedia.org/wiki/Sliding_DFT
+# DFT of the last N samples updated in O(N) per new sample: X_k <- (X_k - oldest + newest) * exp(2j*pi*k/N)
+# the bins are recomputed exactly with an FFT every `resync` samples to stop rounding errors from accumulating
+class SlidingDFT:
+    def __init__(self, N, resync=4096):
+        self.N = N
+        self.resync = resync
+        self.samples = np.zeros(N, dtype=np.complex128) # circular buffer, oldest sample at self.position
+        self.position = 0
+        self.bins = np.zeros(N, dtype=np.complex128)
+        self.twiddles = np.exp(2j * np.pi * np.arange(N) / N)
+        self.updates = 0
+
+    def update(self, sample):
+        oldest = self.samples[self.position]
+        self.samples[self.position] = sample
+        self.position = (self.position + 1) % self.N
+        self.bins += sample - oldest
+        self.bins *= self.twiddles
+        self.updates += 1
+        if self.resync and self.updates % self.resync == 0:
+            FFT(np.roll(self.samples, -self.position), out=self.bins)
+        return self.bins
+
+    # yields the bins after every sample (the same array, updated in place)
+    def push(self, samples):
+        for sample in samples:
+            yield self.update(sample)
+
+    # bins of the last N samples under a window: "rect" or "hann" (applied in the frequency domain)
+    def spectrum(self, window="rect"):
+        if window == "rect":
+            return self.bins.copy()
+        if window == "hann":
+            return 0.5 * self.bins - 0.25 * (np.roll(self.bins, 1) + np.roll(self.bins, -1))
+        raise ValueError("the sliding DFT supports the rect and hann windows")
+
+"""
+loading the input image at its native size
+FFT_2D handles any size, so the image is no longer interpolated up to a power of two;
+with pad=True it is zero-padded to the next fast size (only factors 2, 3 and 5) instead
+"""
+def resizeImg(img, pad=False):
+    cv2 = _cv2()
+    with profile("decode") as stage:
+        image = cv2.imread(img,cv2.IMREAD_GRAYSCALE)
+        stage.allocated(image.nbytes if image is not None else 0)
+    if pad:
+        image = pad_image(image)
+    return image
+
+# zero-pads the bottom and right of a 2D image up to the next fast FFT size in each dimension
+def pad_image(image):
+    height = next_fast_len(len(image))
+    width = next_fast_len(len(image[0]))
+    with profile("resize", height * width * image.itemsize):
+        final_image = np.zeros((height, width), dtype=image.dtype)
+        final_image[:len(image), :len(image[0])] = image
     return final_image
 
 """
 Compression with a specified rate for mode 3
+the rate is the fraction of Fourier coefficients set to 0, the ones with the smallest magnitude go first
 """
-def compression(img, rate):
-    size = (img.shape[0] * img.shape[1]) * rate //100
-    temp = img.flatten()
-   # for i in range(int(size)):
-   #    temp[(np.argpartition(np.abs(img), size))[i]]=0
+# Sparse file format of a compressed spectrum (an uncompressed .npz):
+#   shape        the (M, W) shape of the stored spectrum
+#   image_shape  the (M, N) shape of the image it comes from
+#   half         1 for the half-spectrum of RFFT_2D (W = N//2 + 1), 0 for a full FFT_2D spectrum (W = N)
+#   rate         the compression rate
+#   deltas  linear indices of the kept coefficients, delta-encoded in the narrowest unsigned integer type
+#   values  the kept coefficients as complex64 (or complex128), or as (real, imag) float16 pairs
+#           divided by scale (the largest component, so they stay in float16 range)
+# writing and reading only touch the kept coefficients instead of deflating a full complex128 buffer
+# image_shape is given for a half-spectrum: the (M, N) shape of the real image (N cannot be told from W)
+def save_sparse_spectrum(path, spectrum, rate, value_dtype=np.complex64, image_shape=None):
+    flat = spectrum.reshape(-1)
+    indices = np.flatnonzero(flat)
+    deltas = np.diff(indices, prepend=0)
+    for index_dtype in (np.uint8, np.uint16, np.uint32, np.uint64):
+        if len(deltas) == 0 or deltas.max() <= np.iinfo(index_dtype).max:
+            break
+    values = flat[indices]
+    scale = 1.0
+    if np.dtype(value_dtype) == np.float16:
+        values = np.stack([values.real, values.imag], axis=1)
+        if len(values) > 0:
+            scale = max(float(np.abs(values).max()), np.finfo(float).tiny)
+        values = (values / scale).astype(np.float16)
+    else:
+        values = values.astype(value_dtype)
+    with profile("save", deltas.nbytes + values.nbytes):
+        np.savez(path, shape=np.array(spectrum.shape), rate=np.array(rate), scale=np.array(scale),
+                 image_shape=np.array(spectrum.shape if image_shape is None else image_shape),
+                 half=np.array(int(image_shape is not None)), deltas=deltas.astype(index_dtype), values=values)
+
+# reads a sparse spectrum back, into out when it is given (zeroed first, same shape, complex)
+# returns the spectrum, its compression rate, the shape of the image and whether it is a half-spectrum
+def load_sparse_spectrum(path, out=None):
+    with np.load(path) as data:
+        shape = tuple(int(n) for n in data["shape"])
+        rate = float(data["rate"])
+        image_shape = tuple(int(n) for n in data["image_shape"]) if "image_shape" in data else shape
+        half = bool(data["half"]) if "half" in data else False
+        indices = np.cumsum(data["deltas"], dtype=np.intp)
+        values = data["values"]
+        scale = float(data["scale"])
+    if values.ndim == 2: # float16 (real, imag) pairs
+        values = (values[:, 0] + 1j * values[:, 1].astype(np.float32)) * scale
+    if out is None:
+        out = np.zeros(shape, dtype=np.complex128)
+    else:
+        if out.shape != shape:
+            raise ValueError("out must have the shape of the saved spectrum " + str(shape))
+        out[...] = 0
+    np.put(out, indices, values)
+    return out, rate, image_shape, half
+
+# the compressed image saved in path, with the inverse that matches the stored spectrum
+def load_compressed_image(path, dtype=np.complex128):
+    spectrum, rate, image_shape, half = load_sparse_spectrum(path)
+    if half:
+        return IRFFT_2D(spectrum, image_shape, dtype=dtype)
+    return FFT_2D_inverse(spectrum, dtype=dtype).real
+
+# writes a compressed spectrum to path (default compression-<rate>.npz in the current directory)
+# image_shape is the shape of the real image when compressed_image is its half-spectrum
+def save_compressed(compressed_image, rate, path=None, image_shape=None):
+    if path is None:
+        path = 'compression-'+str(rate)
+    save_sparse_spectrum(path, compressed_image, rate, image_shape=image_shape)
+
+# one rate: the smallest coefficients are selected in O(N) with argpartition
+# the compressed spectrum is saved to path unless save is False
+def compression(img, rate, path=None, save=True, image_shape=None):
+    size = int(img.size * rate) # number of coefficients set to 0
+    with profile("compression", img.nbytes):
+        temp = img.flatten()
+        if size > 0:
+            temp[np.argpartition(np.abs(temp), size - 1)[:size]] = 0
     
     compressed_image = np.reshape(temp, img.shape)
-    np.savez_compressed('compression-'+str(rate), compressed_image)
+    if save:
+        save_compressed(compressed_image, rate, path, image_shape)
 
     return compressed_image
 
+# several rates from a single ranking of the magnitudes: each level zeroes a superset of the previous one,
+# so the levels are produced in increasing rate order by zeroing only the next slice of the ranking
+# yields (rate, compressed spectrum); the same buffer is reused, so use each level before asking for the next
+# image_shape is the shape of the real image when img is its half-spectrum
+def compression_levels(img, rates, prefix="", save=True, image_shape=None):
+    with profile("compression") as stage:
+        temp = img.flatten()
+        order = np.argsort(np.abs(temp))
+        stage.allocated(temp.nbytes + order.nbytes)
+    zeroed = 0
+    for rate in sorted(rates):
+        size = int(temp.size * rate)
+        if size > zeroed:
+            with profile("compression"):
+                temp[order[zeroed:size]] = 0
+            zeroed = size
+        compressed_image = np.reshape(temp, img.shape)
+        if save:
+            save_compressed(compressed_image, rate, prefix + 'compression-' + str(rate), image_shape)
+        yield rate, compressed_image
+
 """
 Different modes of the argument passed
+Each mode is split into a compute step that only returns arrays and timings (usable as a library,
+no plotting or imaging dependency) and a render step that prints and plots them
 """
-def mode1(img):
-    FFT_image = np.abs(FFT_2D(img)) # calling FFT_2D function and save the result in FFT_image
-    
+# mode 1: spectrum of the image
+# dtype=np.complex64 runs the whole mode in single precision
+def mode1_compute(img, dtype=np.complex128):
+    start_time = time.perf_counter()
+    # the image is real, so only the half-spectrum is computed (RFFT_2D) and mirrored for the plot
+    FFT_image = np.abs(half_to_full_spectrum(RFFT_2D(img, dtype=dtype), img.shape[1]))
+    return {"image": img, "spectrum": FFT_image, "timings": {"fft": time.perf_counter() - start_time}}
+
+def mode1_render(result):
+    plot = _pyplot()
     # one by two subplot of the original image 
     plot.subplot(1,2,1)
-    plot.imshow(img, cmap= 'gray')
+    plot.imshow(result["image"], cmap= 'gray')
     plot.title("(Before FFT)")
 
     #one by two subplot of the FFT image
     plot.subplot(1,2,2)
-    plot.imshow(FFT_image, norm=colors.LogNorm())
+    plot.imshow(result["spectrum"], norm=_colors().LogNorm())
     plot.title("(After FFT)")
 
     plot.show()
 
-def mode2(img):
-    print("Mode 2 is running...")
-    # the denoise factor, we chose to go with 0.4
-    denoise_factor = 0.4
-    FFT_image = FFT_2D(img)
-    # count the non zero for later when calculating the fraction 
-    before_zero = np.count_nonzero(FFT_image)
-    # setting the high frequencies to 0 
-    # width 
-    FFT_image[:, int(denoise_factor * FFT_image.shape[1]) : int(FFT_image.shape[1] * (1-denoise_factor))] = 0 
-    # height
-    FFT_image[int(denoise_factor * FFT_image.shape[0]) : int(FFT_image.shape[1] * (1-denoise_factor))] = 0
+def mode1(img, dtype=np.complex128):
+    mode1_render(mode1_compute(img, dtype))
+
+"""
+Frequency-domain denoising with selectable filter masks. A mask only depends on the spectrum shape and the
+filter parameters, so it is built once, cached, and applied as one in-place multiply; a batch of same-size
+spectra (leading dimensions) reuses it without any rebuild. Masks work on full spectra and on the
+half-spectra of RFFT_2D (pass the full image width as full_width)
+"""
+denoise_filters = ("ideal", "butterworth", "gaussian", "gaussian-bandstop", "threshold")
+# the parameter of each filter that the denoise factor (--cutoff) sets
+denoise_factor_params = {"ideal": "cutoff", "butterworth": "cutoff", "gaussian": "cutoff",
+                         "gaussian-bandstop": "band", "threshold": "threshold"}
+mask_cache_max_entries = 16
+
+_masks = OrderedDict()
+_masks_lock = threading.Lock()
+
+# frequency of every index along an axis of length L, as a fraction of the sampling rate (0 to 0.5)
+def _axis_frequencies(L, count):
+    i = np.arange(count)
+    return np.minimum(i, L - i) / L
+
+# keep-or-zero per index along an axis of length L: the lowest cutoff fraction of the frequencies on each side
+# (symmetric, so that the mask of a real image keeps its spectrum conjugate symmetric)
+def _axis_lowpass(L, count, cutoff):
+    i = np.arange(count)
+    return np.minimum(i, L - i) < int(cutoff * L)
+
+# mask for an (M, W) spectrum: W = N for a full spectrum, N//2 + 1 for a half-spectrum with full_width=N
+#   ideal              box low-pass, keeps the lowest `cutoff` fraction of the rows and columns (the original mode 2)
+#   butterworth        1 / (1 + (r / cutoff)^(2 * order)), r is the radial frequency (0 to ~0.7)
+#   gaussian           exp(-r^2 / (2 * cutoff^2))
+#   gaussian-bandstop  1 - exp(-((r^2 - band^2) / (r * width))^2), removes a ring of frequencies around band
+# the mask is cached per (shape, filter, parameters, dtype) and must not be modified
+def denoise_mask(shape, kind="ideal", cutoff=0.4, order=2, band=0.25, width=0.1, full_width=None, dtype=np.float64):
+    M, W = shape
+    N = W if full_width is None else full_width
+    key = (M, W, N, kind, cutoff, order, band, width, np.dtype(dtype))
+    with _masks_lock:
+        mask = _masks.get(key)
+        if mask is not None:
+            _masks.move_to_end(key)
+            return mask
+
+    if kind == "ideal":
+        mask = np.outer(_axis_lowpass(M, M, cutoff), _axis_lowpass(N, W, cutoff))
+    else:
+        fy = _axis_frequencies(M, M).reshape((M, 1))
+        fx = _axis_frequencies(N, W)
+        r = np.sqrt(fy ** 2 + fx ** 2)
+        if kind == "butterworth":
+            mask = 1 / (1 + (r / cutoff) ** (2 * order))
+        elif kind == "gaussian":
+            mask = np.exp(-r ** 2 / (2 * cutoff ** 2))
+        elif kind == "gaussian-bandstop":
+            with np.errstate(divide="ignore", invalid="ignore"):
+                mask = 1 - np.exp(-((r ** 2 - band ** 2) / (r * width)) ** 2)
+            mask[r == 0] = 1
+        else:
+            raise ValueError("unknown filter " + kind + ", use one of " + ", ".join(denoise_filters))
+    mask = mask.astype(dtype)
+    mask.setflags(write=False)
+
+    with _masks_lock:
+        _masks[key] = mask
+        while len(_masks) > mask_cache_max_entries:
+            _masks.popitem(last=False)
+    return mask
+
+# applies the filter to the spectrum in place and returns it; spectrum is (M, W) or a batch (..., M, W)
+# "threshold" zeroes the coefficients smaller than threshold * the largest magnitude (of each spectrum)
+def denoise(spectrum, kind="ideal", full_width=None, threshold=0.001, **params):
+    if kind == "threshold":
+        magnitude = np.abs(spectrum)
+        spectrum[magnitude < threshold * magnitude.max(axis=(-2, -1), keepdims=True)] = 0
+        return spectrum
+    mask = denoise_mask(spectrum.shape[-2:], kind, full_width=full_width, dtype=_real_dtype(spectrum.dtype), **params)
+    spectrum *= mask
+    return spectrum
+
+# denoised image, number of non-zero coefficients kept and the fraction of the original they represent
+# the filter runs on the half-spectrum of the real image, denoise_factor is its main parameter (see
+# denoise_factor_params: the cutoff, the band of gaussian-bandstop or the threshold), None for the filter's default
+# params are the other parameters of denoise and denoise_mask (order, width...)
+def denoise_image(img, denoise_factor=None, dtype=np.complex128, kind="ideal", **params):
+    if kind not in denoise_factor_params:
+        raise ValueError("unknown filter " + kind + ", use one of " + ", ".join(denoise_filters))
+    if denoise_factor is not None:
+        params.setdefault(denoise_factor_params[kind], denoise_factor)
+    # half-spectrum of the real image, columns 0..N/2 only
+    FFT_image = RFFT_2D(img, dtype=dtype)
+    width = img.shape[1]
+    # count the non zero for later when calculating the fraction (as if it was the full spectrum)
+    before_zero = count_nonzero_full(FFT_image, width)
+    # setting the high frequencies to 0 (or attenuating them)
+    with profile("denoise"):
+        denoise(FFT_image, kind, width, **params)
 
     # count the new non zero 
-    after_zero = np.count_nonzero(FFT_image)
+    after_zero = count_nonzero_full(FFT_image, width)
 
-    inverse_FFT_image = FFT_2D_inverse(FFT_image).real
-    # as asked in the assignment printing the fraction and non-zeros 
+    inverse_FFT_image = IRFFT_2D(FFT_image, img.shape, dtype=dtype)
     fraction = (after_zero/before_zero)
-    print(f"The number of non-zeros are: {after_zero}")
-    print(f"The fraction they represent of the original Fourier coefficients: {fraction}")
+    return inverse_FFT_image, after_zero, fraction
+
+# mode 2: denoising
+def mode2_compute(img, denoise_factor=None, dtype=np.complex128, kind="ideal", **params):
+    start_time = time.perf_counter()
+    denoised, non_zeros, fraction = denoise_image(img, denoise_factor, dtype, kind, **params)
+    return {"image": img, "denoised": denoised, "non_zeros": non_zeros, "fraction": fraction,
+            "timings": {"denoise": time.perf_counter() - start_time}}
+
+def mode2_render(result):
+    # as asked in the assignment printing the fraction and non-zeros 
+    print(f"The number of non-zeros are: {result['non_zeros']}")
+    print(f"The fraction they represent of the original Fourier coefficients: {result['fraction']}")
+    plot = _pyplot()
     # before
     plot.subplot(1,2,1)
-    plot.imshow(img, cmap= 'gray')
+    plot.imshow(result["image"], cmap= 'gray')
     plot.title("(Before denoising)")
     # after
     plot.subplot(1,2,2)
-    plot.imshow(inverse_FFT_image, cmap= 'gray')
+    plot.imshow(result["denoised"], cmap= 'gray')
     plot.title("(After denoising)")
     plot.show()
 
-def mode3(img):
-    print("Mode 3 is running...")
-    FFT_image = FFT_2D(img)
-    rate = [0, 0.2, 0.4, 0.6, 0.8, 0.95]
-    # we need to perform compression
-    # we will compress with 6 different levels and plot them 
-    plot.subplot(2,3,1)
-    plot.imshow(np.real(FFT_2D_inverse(compression(FFT_image.copy(), rate[0]))), cmap= 'gray')
-    plot.title("0%")
-
-    plot.subplot(2,3,2)
-    plot.imshow(np.real(FFT_2D_inverse(compression(FFT_image.copy(), rate[1]))), cmap= 'gray')
-    plot.title("20%")
-
-    plot.subplot(2,3,3)
-    plot.imshow(np.real(FFT_2D_inverse(compression(FFT_image.copy(), rate[2]))), cmap= 'gray')
-    plot.title("40%")
-
-    plot.subplot(2,3,4)
-    plot.imshow(np.real(FFT_2D_inverse(compression(FFT_image.copy(), rate[3]))), cmap= 'gray')
-    plot.title("60%")
-
-    plot.subplot(2,3,5)
-    plot.imshow(np.real(FFT_2D_inverse(compression(FFT_image.copy(), rate[4]))), cmap= 'gray')
-    plot.title("80%")
-
-    plot.subplot(2,3,6)
-    plot.imshow(np.real(FFT_2D_inverse(compression(FFT_image.copy(), rate[5]))), cmap= 'gray')
-    plot.title("95%")
+def mode2(img, dtype=np.complex128, kind="ideal", denoise_factor=None, **params):
+    print("Mode 2 is running...")
+    # the denoise factor, we chose to go with a cutoff of 0.4 by default
+    mode2_render(mode2_compute(img, denoise_factor, dtype, kind, **params))
+
+# mode 3: compression with 6 different levels
+# every compressed spectrum is saved to <prefix>compression-<rate>.npz when save is True
+# with reconstruct=False the compressed images are not computed (only the saved spectra are wanted)
+def mode3_compute(img, rates=(0, 0.2, 0.4, 0.6, 0.8, 0.95), save=True, prefix="", dtype=np.complex128, reconstruct=True):
+    timings = {}
+    start_time = time.perf_counter()
+    # half-spectrum of the real image
+    FFT_image = RFFT_2D(img, dtype=dtype)
+    timings["fft"] = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    # one ranking of the coefficients, then one inverse per level
+    images = []
+    for rate, compressed in compression_levels(FFT_image, rates, prefix, save, img.shape):
+        if reconstruct:
+            images.append(IRFFT_2D(compressed, img.shape, dtype=dtype))
+    timings["compression"] = time.perf_counter() - start_time
+    return {"image": img, "rates": sorted(rates), "images": images, "timings": timings}
+
+def mode3_render(result):
+    plot = _pyplot()
+    # we will plot the 6 compression levels in a 2 by 3 grid
+    for i, (rate, image) in enumerate(zip(result["rates"], result["images"])):
+        plot.subplot(2,3,i+1)
+        plot.imshow(image, cmap= 'gray')
+        plot.title(f"{rate:.0%}")
     plot.show()
 
-def mode4(img):
-    print("Mode 4 is running...")
-    testPlots = [np.random.rand(2 ** 5, 2 ** 5),
-        np.random.rand(2 ** 6, 2 ** 6),
-        np.random.rand(2 ** 7, 2 ** 7),
-        np.random.rand(2 ** 8, 2 ** 8),
-        np.random.rand(2 ** 9, 2 ** 9),
-        np.random.rand(2 ** 10, 2 ** 10),
-    ]
-    #y axis for naive implementation
-    naive_time = []
-    #y axis for fast implementation
-    fast_time =[]
-    # x axis for both based on the test plots
-    size_list = [2 ** 5, 2 ** 6, 2 ** 7,2 ** 8, 2 ** 9, 2 ** 10]
-    #size = 2**5
-    #standard daviation of naive implementation 
-    naive_std = []
-    #mean of naive implementation
-    naive_mean =[]
-    #variance of naive implementation
-    naive_variance=[]
-    #standard daviation of fast implementation 
-    fast_std = []
-    #mean of fast implementation
-    fast_mean =[]
-    #variance of fast implementation
-    fast_variance=[]
-
-    #iterator for printing size
-    count = 0
-    for element in testPlots:
-        #the range is 10 based on the assignment description
-        for i in range(10):
-            start_time = time.time()
-            DFT_naive_2D(element)
-            end_time = time.time()
-            duration = end_time-start_time
-            naive_time.append(duration)
-
-            start_time = time.time()
-            FFT_2D(element)
-            end_time = time.time()
-            duration = end_time-start_time
-            fast_time.append(duration)
-       
-        print("The size is :", size_list[count] ,"by", size_list[count] )
-        count += 1
-       # size_list.append(size)
-       # size = size * 2
-        #calculate the mean 
-        naive_mean_var = np.mean(naive_time)
-        fast_mean_var = np.mean(fast_time)
-        print("The mean of the DFT is:", naive_mean_var )
-        print("The mean of the FFT is:", fast_mean_var )
-        #add to the array 
-        naive_mean.append(naive_mean_var)
-        fast_mean.append(fast_mean_var)
-
-        #calculate the standard deviation 
-        naive_std_var = np.std(naive_time)
-        fast_std_var = np.std(fast_time)
-        print("The standard deviation of the DFT is:", naive_std_var )
-        print("The standard deviation of the FFT is:", fast_std_var )
-        #add to the array 
-        naive_std.append(naive_std_var)
-        fast_std.append(fast_std_var)
-
-        naive_variance_var = np.var(naive_time)
-        fast_variance_var = np.var(fast_time)
-        print("The variance of the DFT is:", naive_variance_var)
-        print("The variance of the FFT is:", fast_variance_var)
-        #add to the array 
-        naive_variance.append(naive_variance_var)
-        fast_variance.append(fast_variance_var)
+def mode3(img, dtype=np.complex128):
+    print("Mode 3 is running...")
+    mode3_render(mode3_compute(img, dtype=dtype))
+
+"""
+Benchmarks (mode 4)
+every (path, size) pair is timed in isolation: a few warmup runs (plans, caches), then `repeats` timed runs
+with perf_counter_ns. The results are summarized with robust statistics and can be written to JSON or CSV
+to track regressions across releases
+"""
+default_benchmark_sizes = [2 ** 5, 2 ** 6, 2 ** 7, 2 ** 8, 2 ** 9, 2 ** 10]
+default_benchmark_repeats = 10 # based on the assignment description
+default_benchmark_warmup = 2
+
+# the transforms that are timed: name -> (function of the input, input built from a real test image)
+benchmark_paths = {
+    "naive": (lambda x: DFT_naive_2D(x), lambda image: image),
+    "forward": (lambda x: FFT_2D(x), lambda image: image),
+    "inverse": (lambda x: FFT_2D_inverse(x), lambda image: FFT_2D(image)),
+    "real": (lambda x: RFFT_2D(x), lambda image: image),
+    "batched": (lambda x: FFT_2D(x, workers=None), lambda image: image),
+    "single": (lambda x: FFT_2D(x, dtype=np.complex64), lambda image: image.astype(np.float32)),
+}
+
+# durations in ns of `repeats` calls of function(x) after `warmup` untimed calls
+def time_function(function, x, repeats=default_benchmark_repeats, warmup=default_benchmark_warmup):
+    for _ in range(warmup):
+        function(x)
+    samples = []
+    for _ in range(repeats):
+        start_time = time.perf_counter_ns()
+        function(x)
+        samples.append(time.perf_counter_ns() - start_time)
+    return samples
+
+# statistics of one set of samples (seconds), throughput is the input size over the median time
+def summarize_samples(samples, nbytes):
+    seconds = np.array(samples) / 1e9
+    q1, median, q3, p95 = np.percentile(seconds, [25, 50, 75, 95])
+    return {"median": median, "mean": seconds.mean(), "std": seconds.std(), "variance": seconds.var(),
+            "min": seconds.min(), "p95": p95, "iqr": q3 - q1,
+            "throughput_mb_s": nbytes / median / 1e6 if median > 0 else float("inf")}
+
+# one row per (path, size); image is an extra test input at its own shape (e.g. the image given to mode 4)
+def benchmark(sizes=None, paths=None, repeats=default_benchmark_repeats, warmup=default_benchmark_warmup, image=None, seed=0):
+    sizes = default_benchmark_sizes if sizes is None else sizes
+    paths = list(benchmark_paths) if paths is None else paths
+    random = np.random.default_rng(seed)
+    inputs = [random.random((size, size)) for size in sizes]
+    if image is not None:
+        inputs.append(np.asarray(image, dtype=float))
 
+    results = []
+    for test_image in inputs:
+        for name in paths:
+            function, make_input = benchmark_paths[name]
+            x = make_input(test_image)
+            samples = time_function(function, x, repeats, warmup)
+            row = {"path": name, "rows": x.shape[0], "columns": x.shape[1], "repeats": repeats, "warmup": warmup}
+            row.update(summarize_samples(samples, x.nbytes))
+            results.append(row)
+    return results
+
+# writes the rows to a .json (with the environment they were measured in) or a .csv file
+def write_benchmark(results, path):
+    if path.endswith(".csv"):
+        import csv
+        with open(path, "w", newline="") as file:
+            writer = csv.DictWriter(file, fieldnames=list(results[0]))
+            writer.writeheader()
+            writer.writerows(results)
+        return
+    import json
+    import platform
+    report = {"created": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(),
+              "numpy": np.__version__, "machine": platform.platform(), "cpus": os.cpu_count(),
+              "results": [{key: (float(value) if isinstance(value, np.floating) else value) for key, value in row.items()} for row in results]}
+    with open(path, "w") as file:
+        json.dump(report, file, indent=2)
+
+# mode 4: runtime of the naive DFT against the FFT paths for growing sizes and for the given image
+def mode4_compute(img=None, sizes=None, paths=None, repeats=default_benchmark_repeats, warmup=default_benchmark_warmup):
+    return {"results": benchmark(sizes, paths, repeats, warmup, img)}
+
+def mode4_render(result):
+    results = result["results"]
+    for row in results:
+        print(f"{row['path']:>8} {row['rows']}x{row['columns']}: median {row['median']:.6f} s, p95 {row['p95']:.6f} s, "
+              f"IQR {row['iqr']:.6f} s, std {row['std']:.6f} s, {row['throughput_mb_s']:.1f} MB/s")
+    plot = _pyplot()
     plot.title("Runtime vs Size")
     plot.xlabel("size")
     plot.ylabel("runtime (sec)")
-    plot.errorbar(size_list, naive_mean, yerr=naive_std, linestyle='solid', color='yellow',label="slow")
-    plot.errorbar(size_list, fast_mean, yerr=fast_std, linestyle='solid', color='green',label="fast")
+    for name in dict.fromkeys(row["path"] for row in results):
+        rows = [row for row in results if row["path"] == name and row["rows"] == row["columns"]]
+        plot.errorbar([row["rows"] for row in rows], [row["median"] for row in rows], yerr=[row["iqr"] for row in rows], linestyle='solid', label=name)
+    plot.legend()
     plot.show()
 
+# output is an optional .json or .csv file for the results
+def mode4(img, output=None):
+    print("Mode 4 is running...")
+    result = mode4_compute(img)
+    if output is not None:
+        write_benchmark(result["results"], output)
+    mode4_render(result)
+
+"""
+Batch mode: streams a directory, glob or list of images through load -> FFT -> mode -> save.
+A loader thread decodes the next images into a bounded queue while the current one is transformed,
+so decoding overlaps with compute and at most `prefetch` images are held in memory at any time.
+Results are written to disk, no plot window is opened
+"""
+default_output = "output"
+default_prefetch = 4
+image_extensions = (".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff")
+
+# file paths from a mix of directories, glob patterns and file names, in a stable order
+def expand_inputs(inputs):
+    for item in inputs:
+        if os.path.isdir(item):
+            for name in sorted(os.listdir(item)):
+                if name.lower().endswith(image_extensions):
+                    yield os.path.join(item, name)
+        elif any(c in item for c in "*?["):
+            yield from sorted(glob.glob(item))
+        else:
+            yield item
+
+# yields (path, image, error) in input order, the image is None when it could not be read
+# and error is then the exception raised while decoding it (None when the file is missing or not an image)
+# an exception raised by paths itself stops the loader and is re-raised here
+def prefetch_images(paths, pad=False, prefetch=default_prefetch):
+    images = queue.Queue(maxsize=max(1, prefetch))
+    done = object()
+    stop = threading.Event()
+
+    cv2 = _cv2()
+
+    def loader():
+        # done is always queued, so the consumer never waits for a loader that died
+        try:
+            for path in paths:
+                if stop.is_set():
+                    break
+                try:
+                    with profile("decode") as stage:
+                        image = cv2.imread(path, cv2.IMREAD_GRAYSCALE) if os.path.isfile(path) else None
+                        stage.allocated(image.nbytes if image is not None else 0)
+                    if image is not None and pad:
+                        image = pad_image(image)
+                except Exception as error: # this file only, the next ones are still loaded
+                    images.put((path, None, error))
+                    continue
+                images.put((path, image, None))
+        except Exception as error:
+            images.put(error)
+        finally:
+            images.put(done)
+
+    thread = threading.Thread(target=loader, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = images.get()
+            if item is done:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        # the consumer stopped early: let the loader finish its current image and exit
+        stop.set()
+        while thread.is_alive():
+            try:
+                images.get(timeout=0.1)
+            except queue.Empty:
+                pass
+
+# runs the compute step of the mode on one image and writes its results in output_dir, returns the written paths
+# mode2_params are the keyword arguments of mode2_compute (kind, denoise_factor and the filter parameters)
+def process_image(img, mode, output_dir, name, dtype=np.complex128, mode2_params=None):
+    stem = os.path.join(output_dir, os.path.splitext(os.path.basename(name))[0])
+    if mode == 1: # full spectrum magnitude
+        spectrum = mode1_compute(img, dtype)["spectrum"]
+        with profile("save", spectrum.nbytes):
+            np.save(stem + "-spectrum.npy", spectrum)
+        return [stem + "-spectrum.npy"]
+    if mode == 2: # denoised image
+        denoised = mode2_compute(img, dtype=dtype, **(mode2_params or {}))["denoised"]
+        with profile("save", denoised.size):
+            _cv2().imwrite(stem + "-denoised.png", np.clip(denoised, 0, 255).astype(np.uint8))
+        return [stem + "-denoised.png"]
+    # mode 3: one compressed spectrum per rate, the compressed images themselves are not needed
+    result = mode3_compute(img, prefix=stem + "-", dtype=dtype, reconstruct=False)
+    return [stem + "-compression-" + str(rate) + ".npz" for rate in result["rates"]]
+
+def batch_mode(inputs, mode, output_dir=default_output, pad=False, prefetch=default_prefetch, dtype=np.complex128, mode2_params=None):
+    if mode not in (1, 2, 3): # mode 4 does not take images
+        invalid_type_error()
+    os.makedirs(output_dir, exist_ok=True)
+    processed = 0
+    failed = 0
+    for path, img, error in prefetch_images(expand_inputs(inputs), pad, prefetch):
+        if img is None:
+            print(f"ERROR! Could not read {path}{' (' + str(error) + ')' if error is not None else ''}, skipping it")
+            failed += 1
+            continue
+        written = process_image(img, mode, output_dir, path, dtype, mode2_params)
+        print(f"{path} -> {', '.join(written)}")
+        processed += 1
+    print(f"Batch done: {processed} images processed, {failed} skipped")
+
 """
 Passing arguments
 """
@@ -346,25 +1657,67 @@ def __main__ ():
     # image with the default value of moonlanding.png
     parse.add_argument("-i", dest="image" ,type=str, default=default_image, help="The image should be the filename of the image we wish to take the DFT of")
 
+    # zero-padding to a fast FFT size instead of transforming the image at its native size
+    parse.add_argument("-p", dest="pad", action="store_true", default=False, help="Zero-pad the image to the next size whose only prime factors are 2, 3 and 5")
+
+    # batch mode: directories, glob patterns or image files to process without plotting
+    parse.add_argument("-b", dest="batch", nargs="+", default=None, help="Process all these images (directories, glob patterns or files) and save the results instead of plotting them")
+
+    # output directory of the batch mode
+    parse.add_argument("-o", dest="output", type=str, default=default_output, help="Directory where the batch mode writes its results")
+
+    # how many decoded images the batch mode keeps ready ahead of the one being transformed
+    parse.add_argument("--prefetch", dest="prefetch", type=int, default=default_prefetch, help="Number of images the batch mode loads ahead")
+
+    # mode 4 results file, .json or .csv
+    parse.add_argument("--bench-output", dest="bench_output", type=str, default=None, help="File (.json or .csv) where mode 4 writes its benchmark results")
+
+    # single precision (complex64) instead of double precision for modes 1 to 3
+    parse.add_argument("-s", dest="single", action="store_true", default=False, help="Run the transforms in single precision (complex64), about half the memory traffic")
+
+    # filter used by mode 2 and its parameters (None keeps the default of the filter)
+    parse.add_argument("--filter", dest="filter", type=str, default="ideal", choices=denoise_filters, help="Denoising filter of mode 2")
+    parse.add_argument("--cutoff", dest="cutoff", type=float, default=None, help="Main parameter of the mode 2 filter: the cutoff as a fraction of the sampling frequency (ideal 0.4, butterworth, gaussian), the radius of the removed ring (gaussian-bandstop, 0.25) or the fraction of the largest magnitude below which coefficients are zeroed (threshold, 0.001)")
+    parse.add_argument("--width", dest="width", type=float, default=None, help="Width of the ring removed by the gaussian-bandstop filter (0.1)")
+    parse.add_argument("--order", dest="order", type=int, default=None, help="Order of the butterworth filter (2)")
+
+    # per-stage timings and allocations, printed when the mode is done
+    parse.add_argument("--profile", dest="profile", action="store_true", default=False, help="Measure the time and memory of every stage of the pipeline and print them at the end")
+
     # put all the parser arguments into a variable
     arguments = parse.parse_args()
 
     # store the mode and image arguments into variables
     mode = arguments.mode
     image = arguments.image
+    pad = arguments.pad
+    dtype = np.complex64 if arguments.single else np.complex128
+
+    if arguments.profile:
+        profiler.enable()
+        # the report is printed even when a mode exits early or the plot window is closed
+        atexit.register(profiler.report)
+
+    # the filter parameters given on the command line, the others keep their defaults
+    mode2_params = {"kind": arguments.filter, "denoise_factor": arguments.cutoff}
+    mode2_params.update({name: value for name, value in (("width", arguments.width), ("order", arguments.order)) if value is not None})
+
+    if arguments.batch is not None:
+        batch_mode(arguments.batch, mode, arguments.output, pad, arguments.prefetch, dtype, mode2_params)
+        return
 
     if not (os.path.isfile(image)): # if the image does not exist in the current directory, print an error message
         invalid_image_error()
 
     if (mode == 1): # (Default) image is converted into its FFT form and displayed
         print("Mode 1 is running...")
-        mode1(resizeImg(image))
+        mode1(resizeImg(image, pad), dtype)
     elif (mode == 2): # image is denoised by applying an FFT, truncating high frequencies and then displayed
-        mode2(resizeImg(image))
+        mode2(resizeImg(image, pad), dtype, **mode2_params)
     elif (mode == 3): # for compressing and saving the image
-        mode3(resizeImg(image))
+        mode3(resizeImg(image, pad), dtype)
     elif (mode == 4): # for plotting the runtime graphs for the report
-        mode4(resizeImg(image))
+        mode4(resizeImg(image, pad), arguments.bench_output)
     else:
         invalid_type_error() # if the mode is anything other than [1,4], print the error message
 
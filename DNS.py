@@ -10,7 +10,10 @@ This application is implementing a domain name system (DNS) client using sockets
 It sends a query to the server for the given domain name using a UDP socket protocol and interprets the response to the terminal
 The DNS client should send queries for A (IP address), NS (name server), and MX (mail server) records
 The syntax for running the app is the following:
-python3 DnsClient [-t timeout] [-r max-retries] [-p port] [-mx|-ns] @server name
+python3 DnsClient [-t timeout] [-r max-retries] [-p port] [-mx|-ns] @server [@server ...] name
+(with several servers, the query goes to the fastest known one and is raced on the next one when it is slow)
+or, to resolve many names (one per line, - for stdin) with many queries in flight on one socket:
+python3 DnsClient [-t timeout] [-r max-retries] [-p port] [-c concurrency] [-mx|-ns] -f names @server
 """
 
 import socket
@@ -18,11 +21,27 @@ import argparse # to run a Python script with multiple arguments with cmd
 import time
 import struct
 import random
+import select
+import sys
+import asyncio
+import json
+import os
+import threading
+from collections import OrderedDict, deque
 
 # default arguments 
 default_timeOut = 5 # gives how long to wait before retransmitting an unanswered query
 default_maxRetries = 3 # max number of times to retransmit an uanswered query before giving up 
 default_port = 53 # UPD port number
+default_concurrency = 256 # number of queries the bulk mode keeps in flight at the same time
+default_payload = 4096 # largest UDP response advertised with EDNS0 (0 for a plain 512-byte DNS query)
+default_tcp_idle = 4 # idle TCP connections kept per server
+
+default_cache_entries = 4096 # responses kept by the resolver cache
+default_negative_ttl = 300 # seconds a name error (or a name without records of the type) stays cached
+
+# QTYPE of every record type this client can ask for or decode
+query_types = {"A": 0x0001, "NS": 0x0002, "CNAME": 0x0005, "MX": 0x000f}
 
 def __main__ ():
 
@@ -37,11 +56,21 @@ def __main__ ():
     # port with the default value of 53
     parse.add_argument("-p", "--port", type=int, default= default_port, help="The UDP port number of the DNS server")
 
-    # IPv4 address of the DNS server in a.b.c.d format (required)
-    parse.add_argument(dest="ip_address", type=str, help= "The IPv4 address of the DNS server")
+    # IPv4 addresses of the DNS servers in @a.b.c.d format (at least one), then the domain name
+    # (required unless the names come from a file)
+    parse.add_argument(dest="targets", type=str, nargs="+", metavar="@server [@server ...] name", help="The IPv4 address of each DNS server (queries are raced between them), then the domain name")
+
+    # bulk mode: file with one domain name per line, - for the standard input
+    parse.add_argument("-f", "--file", dest="names_file", type=str, default=None, help="Resolve every name of this file (one per line, - for stdin) instead of a single domain name")
+
+    # response cache, kept in this file between runs
+    parse.add_argument("--cache", dest="cache_file", type=str, default=None, help="Cache the responses (honoring their TTL) in this file, so that later runs answer from it")
 
-    # domain name (required)
-    parse.add_argument(dest="domain_name", type=str, help="Domain name of the IP address")
+    # EDNS0 UDP payload size
+    parse.add_argument("--payload", type=int, default=default_payload, help="Largest UDP response advertised to the server with EDNS0, 0 to send plain 512-byte queries")
+
+    # number of queries in flight at once in bulk mode
+    parse.add_argument("-c", "--concurrency", type=int, default=default_concurrency, help="Maximum number of unanswered queries in bulk mode")
 
     group = parse.add_mutually_exclusive_group() # so that the user can't select both types -mx and -ns together
 
@@ -58,8 +87,14 @@ def __main__ ():
     timeout = arguments.timeout
     max_retries = arguments.maxretries
     port = arguments.port
-    ip_address = arguments.ip_address[1:] # to remove the first letter (@) of the ip_address typed by the user
-    domain_name = arguments.domain_name
+    # remove the first letter (@) of the ip addresses typed by the user
+    ip_address = [target[1:] for target in arguments.targets if target.startswith("@")]
+    names = [target for target in arguments.targets if not target.startswith("@")]
+    if not ip_address:
+        parse.error("at least one @server is required")
+    if len(names) > 1:
+        parse.error("only one domain name can be given, use -f for more")
+    domain_name = names[0] if names else None
     is_mx = arguments.mx 
     is_ns = arguments.ns
     is_A = (not (is_mx)) and (not (is_ns))
@@ -77,21 +112,48 @@ def __main__ ():
     else:
         invalid_type_error()
 
+    cache = None
+    if arguments.cache_file is not None:
+        cache = ResolverCache()
+        cache.load(arguments.cache_file)
+
+    if arguments.names_file is not None: # bulk mode
+        bulk_main(arguments.names_file, queryNumber, ip_address, port, timeout, max_retries, arguments.concurrency, cache, arguments.payload)
+        if cache is not None:
+            cache.save(arguments.cache_file)
+        return
+
+    if domain_name is None:
+        parse.error("a domain name or a file of names (-f) is required")
+
     # summarize the query to be sent
     summarize(domain_name, ip_address, queryType)
 
-    # send a request to the client after building the DNS packet
-    result = send_request(max_retries, timeout, domain_name, queryNumber, ip_address,port)
+    response = cache.get(domain_name, queryNumber) if cache is not None else None
+    if response is not None:
+        print("Response served from the cache")
+    else:
+        # send a request to the client after building the DNS packet
+        result = send_request(max_retries, timeout, domain_name, queryNumber, ip_address,port, arguments.payload)
+        if result is None: # no response at all
+            exit(1)
+        response = parse_response(result)
+        if cache is not None:
+            cache.put(domain_name, queryNumber, response)
+            cache.save(arguments.cache_file)
 
-    display_output(result, domain_name)
+    display_response(response)
 
-def packet_builder(domain_name, queryNumber):
+# with a payload, an EDNS0 OPT record (RFC 6891) tells the server it may answer with up to payload bytes over UDP
+def packet_builder(domain_name, queryNumber, query_id=None, payload=None):
     # build request packets 
     # help from https://stackoverflow.com/questions/24814044/having-trouble-building-a-dns-packet-in-python
     # >H is used we need big Endian for unsigned short and so we need to reverse the bits 
     
-    # generate a 16-bit random number for ID for each request
-    req_pkt = struct.pack(">H", random.getrandbits(16))
+    # generate a 16-bit random number for ID for each request (unless the caller picked one)
+    if query_id is None:
+        query_id = random.getrandbits(16)
+    req_pkt = struct.pack(">H", query_id)
 
     # Flag
     req_pkt += struct.pack(">H", 0x0100) # 0x0100 = 256 = 0b 0000 0001 0000 0000
@@ -107,137 +169,879 @@ def packet_builder(domain_name, queryNumber):
     req_pkt += struct.pack(">H", 0x0000) # set to 0 (ignore)
 
     # ARCOUNT
-    req_pkt += struct.pack(">H", 0x0000) # number of Resource Records in the additional records section
+    req_pkt += struct.pack(">H", 0x0001 if payload else 0x0000) # number of Resource Records in the additional records section (the OPT record)
     
     # parsing the name server
     # QNAME
-    for i in domain_name.split("."): # domain name is a sequence of labels separated by dots
-        req_pkt += struct.pack(">B", len(i)) # put the length of each section into question
-        for part in i:
-            req_pkt+= struct.pack("c", part.encode('utf-8')) # put the characters of each section into question
-    req_pkt += struct.pack(">B", 0) # put 0 at the end of QNAME field
+    req_pkt += encode_name(domain_name)
 
     # QTYPE
     req_pkt += struct.pack(">H", queryNumber) # specifying the type of query
 
     # QCLASS
     req_pkt += struct.pack(">H", 0x0001) # Always 1 representing an Internet address
+
+    # OPT record: root name, TYPE 41, the UDP payload size as CLASS, extended RCODE/version/flags 0, no options
+    if payload:
+        req_pkt += struct.pack(">BHHIH", 0, 41, payload, 0, 0)
     return req_pkt
 
-def send_request(max_retries, timeout, domain_name, queryNumber, ip_address, port):
-    finished = False
-    for i in range(max_retries): # try sending request max_retries number of times
-        client_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM) # create a client socket object using IPV4 and UDP protocols
-        client_socket.settimeout(timeout) # set the timeout for the client socket
+# QNAME of domain_name: the length and characters of each label, then a 0 length (the root)
+# a trailing dot (the root written explicitly) is ignored; raises DnsError when the name cannot be encoded
+def encode_name(domain_name):
+    if domain_name.endswith("."):
+        domain_name = domain_name[:-1]
+    qname = b""
+    for label in domain_name.split(".") if domain_name else []: # domain name is a sequence of labels separated by dots
+        try:
+            encoded = label.encode("ascii")
+        except UnicodeEncodeError:
+            raise DnsError(f"{domain_name} is not an ASCII name") from None
+        if not 0 < len(encoded) <= 63:
+            raise DnsError(f"{domain_name} has an empty label or one longer than 63 characters")
+        qname += struct.pack(">B", len(encoded)) + encoded
+    qname += struct.pack(">B", 0)
+    if len(qname) > 255:
+        raise DnsError(f"{domain_name} is longer than 255 bytes")
+    return qname
+
+# size of the receive buffer for a UDP response to a query advertising payload
+def _receive_size(payload):
+    return max(512, payload or 0)
+
+# True when the response has the TC bit, so the full answer must be asked for over TCP
+def is_truncated(answer):
+    return bool(struct.unpack_from(">H", answer, 2)[0] & 0x0200)
+
+# the question section (QNAME, QTYPE and QCLASS) of a packet built by packet_builder
+def question_section(packet):
+    end = 12
+    while packet[end]:
+        end += packet[end] + 1
+    return bytes(packet[12:end + 5])
+
+# True when answer carries exactly this question, so it cannot be a late reply to another query that used the same ID
+# (the name is compared without case, like DNS names)
+def answers_question(answer, question):
+    if len(answer) < 12 + len(question) or struct.unpack_from(">H", answer, 4)[0] != 1:
+        return False
+    name = len(question) - 4
+    return (bytes(answer[12:12 + name]).lower() == question[:name].lower()
+            and answer[12 + name:12 + len(question)] == question[name:])
+
+"""
+Retransmission: the timeout of a server adapts to its measured round trips like TCP's (RFC 6298),
+RTO = SRTT + 4 * RTTVAR, doubled at every retry of the same query. Every retry gets a new ID and all the IDs
+of a query stay accepted, so a late answer to an earlier try is used and tells exactly which send it answers
+"""
+default_min_rto = 0.1 # seconds, lower bound of the adaptive timeout
+default_max_rto = 60 # seconds, upper bound of the adaptive timeout (after the backoff)
+
+class RttEstimator:
+    def __init__(self, initial=default_timeOut, minimum=default_min_rto, maximum=default_max_rto):
+        self.minimum = minimum
+        self.maximum = max(maximum, initial)
+        self.srtt = None
+        self.rttvar = None
+        self.rto = initial # the timeout before any measurement
+
+    def sample(self, rtt):
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt
+        self.rto = min(self.maximum, max(self.minimum, self.srtt + 4 * self.rttvar))
+
+    # how long to wait for try number attempt (0 for the first send)
+    def timeout(self, attempt=0):
+        return min(self.maximum, self.rto * 2 ** attempt)
+
+"""
+Several servers: every server keeps an EWMA of its latency, a failure score (EWMA of its timeouts) and its recent
+round trips. A query goes first to the server with the lowest expected cost; when it has not answered after that
+server's hedge percentile of round trips, the query is also sent to the next server, and the first answer wins
+"""
+default_ewma_weight = 0.2 # weight of a new measurement in the latency and failure averages
+default_hedge_percentile = 0.95 # a query is raced on the next server after this percentile of the round trips
+default_rtt_samples = 64 # recent round trips kept per server for the percentile
+default_initial_hedge = 0.2 # seconds before racing a server whose round trips were never measured
+
+class ServerStats:
+    def __init__(self, timeout=default_timeOut):
+        self.estimator = RttEstimator(timeout)
+        self.latency = None # EWMA of the round trips, None before the first answer
+        self.failures = 0.0 # EWMA of 1 per timeout and 0 per answer
+        self.samples = deque(maxlen=default_rtt_samples)
+
+    def success(self, rtt):
+        self.estimator.sample(rtt)
+        self.samples.append(rtt)
+        self.latency = rtt if self.latency is None else (1 - default_ewma_weight) * self.latency + default_ewma_weight * rtt
+        self.failures *= 1 - default_ewma_weight
+
+    def failure(self):
+        self.failures = (1 - default_ewma_weight) * self.failures + default_ewma_weight
+
+    # expected time to an answer: the latency, plus a timeout for the fraction of the queries that fail
+    # a server never measured is assumed as slow as the initial hedge delay, so it is tried before a failing
+    # server but not before one measured to be fast
+    def cost(self):
+        latency = self.latency if self.latency is not None else default_initial_hedge
+        return (1 - self.failures) * latency + self.failures * self.estimator.rto
+
+    # how long to wait for the server before racing the query on another one
+    def hedge_delay(self, percentile=default_hedge_percentile):
+        if not self.samples:
+            return min(self.estimator.rto, default_initial_hedge)
+        ordered = sorted(self.samples)
+        return min(self.estimator.rto, ordered[min(len(ordered) - 1, int(percentile * len(ordered)))])
+
+# when to send the tries of one query that keeps the same ID on every server (bulk mode and the asyncio API):
+# the first send to the next server waits for the hedge delay, a resend to a server waits for its own timeout
+class RacedQuery:
+    def __init__(self, order, stats, max_retries, now):
+        self.order = order # the servers from the best ranked
+        self.stats = stats # server -> ServerStats
+        self.max_retries = max_retries # tries per server
+        self.tries = {} # server -> [number of sends, last send time, deadline of the last send or None once it timed out]
+        self.next_server = now # when to race the next server not asked yet
+
+    # the servers to send the query to at now; counts the tries that timed out as failures
+    def due(self, now):
+        servers = []
+        for server, tries in self.tries.items():
+            if tries[2] is not None and tries[2] <= now:
+                self.stats(server).failure()
+                tries[2] = None
+                if tries[0] < self.max_retries:
+                    servers.append(server)
+        if len(self.tries) < len(self.order) and now >= self.next_server:
+            servers.append(self.order[len(self.tries)])
+        return servers
+
+    def sent(self, server, now):
+        stats = self.stats(server)
+        tries = self.tries.setdefault(server, [0, now, None])
+        wait = stats.estimator.timeout(tries[0])
+        tries[0] += 1
+        tries[1] = now
+        tries[2] = now + wait
+        if tries[0] == 1:
+            self.next_server = now + min(stats.hedge_delay(), wait)
+
+    # when due() has something to do next, None once every try is done and timed out
+    def next_event(self):
+        events = [tries[2] for tries in self.tries.values() if tries[2] is not None]
+        if len(self.tries) < len(self.order):
+            events.append(self.next_server)
+        return min(events) if events else None
+
+    # server answered: its round trip is measured when it had a single try (Karn's rule, the tries share the ID),
+    # and the servers still waited for lost the race
+    def answered(self, server, now):
+        tries = self.tries[server]
+        if tries[0] == 1 and tries[2] is not None:
+            self.stats(server).success(now - tries[1])
+        for other, other_tries in self.tries.items():
+            if other != server and other_tries[2] is not None:
+                self.stats(other).failure()
+
+"""
+TCP fallback: a response with the TC bit set is asked for again over TCP, where every message is prefixed with
+its 2-byte length (RFC 1035 4.2.2). The connections are kept open per server and reused by the next queries
+"""
+def _receive_exactly(connection, count):
+    data = bytearray()
+    while len(data) < count:
+        chunk = connection.recv(count - len(data))
+        if not chunk:
+            raise ConnectionError("the server closed the connection")
+        data += chunk
+    return bytes(data)
+
+class TcpPool:
+    def __init__(self, max_idle=default_tcp_idle):
+        self.max_idle = max_idle
+        self.idle = {} # (ip address, port) -> idle connected sockets
+        self.lock = threading.Lock()
+
+    # response to packet from server, raises DnsError when the exchange fails
+    def query(self, server, packet, timeout=default_timeOut):
+        for _ in range(2): # a pooled connection may have been closed by the server, then a new one is tried
+            with self.lock:
+                connections = self.idle.get(server)
+                connection = connections.pop() if connections else None
+            reused = connection is not None
+            try:
+                if connection is None:
+                    connection = socket.create_connection(server, timeout)
+                connection.settimeout(timeout)
+                connection.sendall(struct.pack(">H", len(packet)) + packet)
+                length = struct.unpack(">H", _receive_exactly(connection, 2))[0]
+                answer = _receive_exactly(connection, length)
+            except OSError as error:
+                if connection is not None:
+                    connection.close()
+                if reused:
+                    continue
+                raise DnsError(f"TCP query to {server[0]} failed: {error}")
+            self.release(server, connection)
+            return answer
+        raise DnsError(f"TCP query to {server[0]} failed")
+
+    def release(self, server, connection):
+        with self.lock:
+            connections = self.idle.setdefault(server, [])
+            if len(connections) < self.max_idle:
+                connections.append(connection)
+                return
+        connection.close()
+
+    def close(self):
+        with self.lock:
+            for connections in self.idle.values():
+                for connection in connections:
+                    connection.close()
+            self.idle.clear()
+
+# blocking resolver on one UDP socket, reused by all its queries, and a pool of TCP connections for truncated answers
+class Resolver:
+    def __init__(self, timeout=default_timeOut, max_retries=default_maxRetries, cache=None, payload=default_payload):
+        self.timeout = timeout # initial timeout, before the first round trip of a server is measured
+        self.max_retries = max_retries
+        self.cache = cache # optional ResolverCache consulted before the network
+        self.payload = payload # EDNS0 UDP payload size, 0 or None for none
+        self.servers = {} # (ip address, port) -> ServerStats
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM) # create a client socket object using IPV4 and UDP protocols
+        self.tcp = TcpPool()
+
+    def close(self):
+        self.socket.close()
+        self.tcp.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def stats(self, server):
+        stats = self.servers.get(server)
+        if stats is None:
+            stats = self.servers[server] = ServerStats(self.timeout)
+        return stats
+
+    def estimator(self, server):
+        return self.stats(server).estimator
+
+    # the servers from the lowest expected cost to the highest (ties keep the given order)
+    def rank(self, servers):
+        return sorted(servers, key=lambda server: self.stats(server).cost())
+
+    # sends the query until it is answered or max_retries tries per server are done
+    # ip_address is one address or a list of them: the query goes to the best ranked server and is raced on
+    # the next one whenever the current one is slower than its hedge delay
+    # returns (response bytes or None when no try was answered, seconds since the first send, number of retries)
+    # on_timeout(attempt, waited) is called whenever a try times out
+    def query(self, domain_name, queryNumber, ip_address, port=default_port, on_timeout=None):
+        answer, time_taken, retries, _ = self.query_servers(domain_name, queryNumber, ip_address, port, on_timeout)
+        return answer, time_taken, retries
+
+    # same as query, also returns the (ip address, port) that answered (None without an answer)
+    def query_servers(self, domain_name, queryNumber, ip_address, port=default_port, on_timeout=None):
+        addresses = [ip_address] if isinstance(ip_address, str) else list(ip_address)
+        order = self.rank([(address, port) for address in addresses])
+        sent = {} # ID -> (server, send time, packet) of every try of this query
+        outstanding = {} # ID -> (deadline, wait, attempt) of the tries not answered nor timed out yet
+        attempts = {} # server -> number of tries sent to it
+        resend = {} # server -> when to send its next try, once its last one timed out
+        sends = 0
+        next_server = first_send = time.monotonic() # when to race the next server not asked yet
+        while True:
+            now = time.monotonic()
+            for query_id, (deadline, wait, attempt) in list(outstanding.items()):
+                if deadline <= now:
+                    del outstanding[query_id]
+                    self.stats(sent[query_id][0]).failure()
+                    if on_timeout is not None:
+                        on_timeout(attempt, wait)
+            # resend to a server only after its own timeout, and race a new server after the hedge delay
+            due = [server for server in attempts if attempts[server] < self.max_retries and now >= resend[server]]
+            if len(attempts) < len(order) and now >= next_server:
+                due.append(order[len(attempts)])
+            for server in due:
+                stats = self.stats(server)
+                attempt = attempts.get(server, 0)
+                query_id = random.getrandbits(16)
+                while query_id in sent:
+                    query_id = random.getrandbits(16)
+                packet = packet_builder(domain_name, queryNumber, query_id, self.payload)
+                self.socket.sendto(packet, server)
+                sent[query_id] = (server, now, packet)
+                wait = stats.estimator.timeout(attempt)
+                outstanding[query_id] = (now + wait, wait, attempt)
+                attempts[server] = attempt + 1
+                resend[server] = now + wait
+                sends += 1
+                if attempt == 0:
+                    next_server = now + min(stats.hedge_delay(), wait)
+
+            pending = [resend[server] for server in attempts if attempts[server] < self.max_retries]
+            if len(attempts) < len(order):
+                pending.append(next_server)
+            if not pending and not outstanding:
+                return None, time.monotonic() - first_send, sends - 1, None
+
+            remaining = min([deadline for deadline, _, _ in outstanding.values()] + pending) - time.monotonic()
+            if remaining <= 0:
+                continue
+            self.socket.settimeout(remaining)
+            try:
+                answer, address = self.socket.recvfrom(_receive_size(self.payload))
+            except socket.timeout:
+                continue
+            if len(answer) < 12:
+                continue
+            answer_id = struct.unpack_from(">H", answer)[0]
+            if answer_id not in sent or sent[answer_id][0] != address or not answers_question(answer, question_section(sent[answer_id][2])):
+                continue # late answer to an earlier query, or not from the server asked
+            server, send_time, packet = sent[answer_id]
+            self.stats(server).success(time.monotonic() - send_time)
+            # the servers still waited for lost the race: count it against them, or they would keep their rank
+            for loser in {sent[query_id][0] for query_id in outstanding} - {server}:
+                self.stats(loser).failure()
+            if is_truncated(answer): # the full answer does not fit in a datagram
+                answer = self.tcp.query(server, packet, self.stats(server).estimator.timeout(1))
+            return answer, time.monotonic() - first_send, sends - 1, server
+
+    # parsed response, from the cache when it has it; raises DnsError when no try was answered
+    def resolve(self, name, qtype="A", ip_address="8.8.8.8", port=default_port):
+        queryNumber = query_types[qtype] if isinstance(qtype, str) else qtype
+        if self.cache is not None:
+            response = self.cache.get(name, queryNumber)
+            if response is not None:
+                return response
+        answer, _, _ = self.query(name, queryNumber, ip_address, port)
+        if answer is None:
+            raise DnsError(f"no response for {name} after {self.max_retries} tries")
+        response = parse_response(answer)
+        if self.cache is not None:
+            self.cache.put(name, queryNumber, response)
+        return response
+
+# returns the response received from the server, or None after max_retries unanswered tries
+# ip_address is one address or a list of addresses that the query is raced between
+def send_request(max_retries, timeout, domain_name, queryNumber, ip_address, port, payload=default_payload):
+    def on_timeout(attempt, waited):
+        print(f"ERROR    Time Out Error. No response after {waited:.3f} seconds")
+
+    with Resolver(timeout, max_retries, payload=payload) as resolver:
         try:
-            start_time = time.time()
-            # without connecting to any server (TCP), with UDP we can send the request packet to the tuple (ip address, port number)
-            client_socket.sendto(packet_builder(domain_name, queryNumber), (ip_address, port))
-            answer, _ = client_socket.recvfrom(512) # wait until get an reply from the server
-            finished = True
-            end_time = time.time()
-            time_taken = end_time - start_time # compute the length of time taken to send the request and receive a response from the server
-            print(f"Response received after {time_taken} seconds ({i} retries)")
-            if (finished): # if a response is received, break from the for loop
-                break
-        except socket.timeout:
-            print(f"ERROR    Time Out Error. You set {timeout} seconds to wait")
-            if(i >= max_retries):
-                print(f"ERROR   Maximum number of retries {max_retries} exceeded")
-
-    return answer # return the response received from the server
+            answer, time_taken, retries, server = resolver.query_servers(domain_name, queryNumber, ip_address, port, on_timeout)
+        except DnsError as error: # the TCP fallback failed
+            print(f"ERROR    {error}")
+            return None
+    if answer is None:
+        print(f"ERROR   Maximum number of retries {max_retries} exceeded")
+        return None
+    if isinstance(ip_address, str):
+        print(f"Response received after {time_taken} seconds ({retries} retries)")
+    else:
+        print(f"Response received from {server[0]} after {time_taken} seconds ({retries} retries)")
+    return answer
+
+# bulk mode: resolves every name of names on a single UDP socket, with up to `concurrency` queries in flight
+# replies are matched to their query by the 16-bit ID (unique among the queries in flight), the question and the
+# address of a server the query was sent to
+# yields (name, response or None if it was never answered, seconds from the first send to the reply) as replies arrive
+# a truncated reply is asked for again over a pooled TCP connection
+# ip_address is one address or a list of them: like Resolver.query_servers, every query goes first to the server
+# with the lowest expected cost and is raced on the next one after the hedge delay, with max_retries tries per server
+# (stats, server -> ServerStats, can be kept across runs)
+def bulk_resolve(names, queryNumber, ip_address, port, timeout=default_timeOut, max_retries=default_maxRetries, concurrency=default_concurrency, payload=default_payload, stats=None):
+    concurrency = max(1, min(concurrency, 1 << 16))
+    names = iter(names)
+    in_flight = {} # ID -> (name, packet, first send time, question, RacedQuery)
+    client_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    client_socket.setblocking(False)
+    servers = [(address, port) for address in ([ip_address] if isinstance(ip_address, str) else ip_address)]
+    stats = {} if stats is None else stats
+    for server in servers:
+        stats.setdefault(server, ServerStats(timeout))
+    tcp = TcpPool()
+    exhausted = False
+
+    def send(query, now):
+        for server in query[4].due(now):
+            try:
+                client_socket.sendto(query[1], server)
+            except (BlockingIOError, InterruptedError):
+                pass # the send buffer is full, the try simply times out and is sent again
+            query[4].sent(server, now)
+
+    try:
+        while True:
+            # fill the window
+            while not exhausted and len(in_flight) < concurrency:
+                name = next(names, None)
+                if name is None:
+                    exhausted = True
+                    break
+                query_id = random.getrandbits(16)
+                while query_id in in_flight:
+                    query_id = random.getrandbits(16)
+                now = time.monotonic()
+                try:
+                    packet = packet_builder(name, queryNumber, query_id, payload)
+                except DnsError: # a name that cannot be sent fails alone, the others are still resolved
+                    yield name, None, 0.0
+                    continue
+                order = sorted(servers, key=lambda server: stats[server].cost())
+                query = (name, packet, now, question_section(packet), RacedQuery(order, stats.__getitem__, max_retries, now))
+                in_flight[query_id] = query
+                send(query, now)
+            if not in_flight:
+                return
+
+            # wait for a reply or the closest retransmission or hedge
+            wait = max(0.0, min(query[4].next_event() or 0.0 for query in in_flight.values()) - time.monotonic())
+            readable, _, _ = select.select([client_socket], [], [], wait)
+            if readable:
+                while True:
+                    try:
+                        answer, address = client_socket.recvfrom(_receive_size(payload))
+                    except (BlockingIOError, InterruptedError):
+                        break
+                    if len(answer) < 12:
+                        continue
+                    query_id = struct.unpack_from(">H", answer)[0]
+                    query = in_flight.get(query_id)
+                    # the reply must come from a server the query was sent to and carry its question,
+                    # otherwise it is a late or duplicate reply to an earlier query that had the same ID
+                    if query is not None and address in query[4].tries and answers_question(answer, query[3]):
+                        del in_flight[query_id]
+                        query[4].answered(address, time.monotonic())
+                        if is_truncated(answer):
+                            try:
+                                answer = tcp.query(address, query[1], stats[address].estimator.timeout(1))
+                            except DnsError:
+                                answer = None
+                        yield query[0], answer, time.monotonic() - query[2]
+
+            # retransmit the expired tries and race the next servers, give up on the queries out of tries
+            now = time.monotonic()
+            for query_id, query in list(in_flight.items()):
+                send(query, now)
+                if query[4].next_event() is None:
+                    del in_flight[query_id]
+                    yield query[0], None, now - query[2]
+    finally:
+        client_socket.close()
+        tcp.close()
+
+# prints one line per record of every name read from names_file (- for stdin), then a summary
+# the names found in the cache are printed right away and only the others are sent
+def bulk_main(names_file, queryNumber, ip_address, port, timeout, max_retries, concurrency, cache=None, payload=default_payload):
+    source = sys.stdin if names_file == "-" else open(names_file)
+    names = (line.strip() for line in source)
+    counts = {"resolved": 0, "failed": 0}
+    start_time = time.time()
+
+    def output(name, response):
+        if response.rcode != 0:
+            print(f"{name}    {'NOTFOUND' if response.rcode == 3 else 'ERROR'}    RCODE {response.rcode}")
+            counts["failed"] += 1
+            return
+        if not response.answers:
+            print(f"{name}    NOTFOUND")
+        for record in response.answers:
+            print(f"{name}    {record.format(response.auth)}")
+        counts["resolved"] += 1
+
+    def misses():
+        for name in names:
+            if not name:
+                continue
+            try:
+                encode_name(name)
+            except DnsError as error:
+                print(f"{name}    ERROR    {error}")
+                counts["failed"] += 1
+                continue
+            response = cache.get(name, queryNumber) if cache is not None else None
+            if response is None:
+                yield name
+            else:
+                output(name, response)
+
+    try:
+        for name, answer, time_taken in bulk_resolve(misses(), queryNumber, ip_address, port, timeout, max_retries, concurrency, payload):
+            if answer is None:
+                print(f"{name}    ERROR    no response after {max_retries} tries (or failed over TCP)")
+                counts["failed"] += 1
+                continue
+            response = parse_response(answer)
+            if cache is not None:
+                cache.put(name, queryNumber, response)
+            output(name, response)
+    finally:
+        if source is not sys.stdin:
+            source.close()
+    print(f"Bulk done: {counts['resolved']} names resolved, {counts['failed']} failed in {time.time() - start_time:.3f} seconds")
+
+"""
+asyncio API: many lookups from one event loop, all sharing one UDP endpoint.
+Replies are matched to their query by ID, so thousands of resolve() calls can be in flight at once
+"""
+class DnsError(Exception):
+    pass
+
+class DnsClientProtocol(asyncio.DatagramProtocol):
+    def __init__(self):
+        self.transport = None
+        self.pending = {} # ID -> (future of (response, server), question section of the query, servers it was sent to)
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, address):
+        if len(data) < 12:
+            return
+        query_id = struct.unpack_from(">H", data)[0]
+        pending = self.pending.get(query_id)
+        # a reply without the question of the query, or from a server not asked, is a late reply to an earlier
+        # query that had the same ID
+        if pending is None or address not in pending[2] or not answers_question(data, pending[1]):
+            return
+        future = self.pending.pop(query_id)[0]
+        if not future.done():
+            future.set_result((data, address))
+
+    def error_received(self, exc):
+        pass # an ICMP error (port unreachable...) shows up as a timeout of the query
+
+    def connection_lost(self, exc):
+        for future, _, _ in self.pending.values():
+            if not future.done():
+                future.set_exception(DnsError("the DNS endpoint was closed"))
+        self.pending.clear()
+
+# ip_address is one address or a list of them, raced like in Resolver.query_servers
+class AsyncResolver:
+    def __init__(self, ip_address, port=default_port, timeout=default_timeOut, max_retries=default_maxRetries, cache=None, payload=default_payload):
+        self.timeout = timeout
+        self.max_retries = max_retries # tries per server
+        self.cache = cache # optional ResolverCache consulted before the network
+        self.payload = payload # EDNS0 UDP payload size, 0 or None for none
+        addresses = [ip_address] if isinstance(ip_address, str) else ip_address
+        self.servers = {(address, port): ServerStats(timeout) for address in addresses} # (ip address, port) -> ServerStats
+        self.protocol = None
+        self.tcp_idle = {} # (ip address, port) -> idle (reader, writer) TCP connections to the server
+
+    async def open(self):
+        if self.protocol is None:
+            loop = asyncio.get_running_loop()
+            _, self.protocol = await loop.create_datagram_endpoint(DnsClientProtocol, local_addr=("0.0.0.0", 0))
+        return self
+
+    def close(self):
+        if self.protocol is not None:
+            self.protocol.transport.close()
+            self.protocol = None
+        for connections in self.tcp_idle.values():
+            for _, writer in connections:
+                writer.close()
+        self.tcp_idle.clear()
+
+    # the servers from the lowest expected cost to the highest (ties keep the given order)
+    def rank(self):
+        return sorted(self.servers, key=lambda server: self.servers[server].cost())
+
+    # response to packet from server over TCP, on a pooled connection when one is idle
+    async def tcp_query(self, server, packet):
+        idle = self.tcp_idle.setdefault(server, [])
+        timeout = self.servers[server].estimator.timeout(1)
+        for _ in range(2): # a pooled connection may have been closed by the server, then a new one is tried
+            reused = bool(idle)
+            writer = None
+            try:
+                if reused:
+                    reader, writer = idle.pop()
+                else:
+                    reader, writer = await asyncio.wait_for(asyncio.open_connection(*server), timeout)
+                writer.write(struct.pack(">H", len(packet)) + packet)
+                await writer.drain()
+                length = struct.unpack(">H", await asyncio.wait_for(reader.readexactly(2), timeout))[0]
+                answer = await asyncio.wait_for(reader.readexactly(length), timeout)
+            except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError) as error:
+                if writer is not None:
+                    writer.close()
+                if reused:
+                    continue
+                raise DnsError(f"TCP query to {server[0]} failed: {error!r}")
+            if len(idle) < default_tcp_idle:
+                idle.append((reader, writer))
+            else:
+                writer.close()
+            return answer
+        raise DnsError(f"TCP query to {server[0]} failed")
+
+    async def __aenter__(self):
+        return await self.open()
+
+    async def __aexit__(self, *exc):
+        self.close()
+
+    # DnsResponse for the name, qtype is "A", "NS", "MX" or "CNAME" (or the QTYPE number)
+    # raises DnsError when no reply arrives after max_retries tries per server
+    async def resolve(self, name, qtype="A"):
+        queryNumber = query_types[qtype] if isinstance(qtype, str) else qtype
+        if self.cache is not None:
+            response = self.cache.get(name, queryNumber)
+            if response is not None:
+                return response
+        await self.open()
+        protocol = self.protocol
+        query_id = random.getrandbits(16)
+        while query_id in protocol.pending:
+            query_id = random.getrandbits(16)
+        packet = packet_builder(name, queryNumber, query_id, self.payload)
+        future = asyncio.get_running_loop().create_future()
+        query = RacedQuery(self.rank(), self.servers.__getitem__, self.max_retries, time.monotonic())
+        protocol.pending[query_id] = (future, question_section(packet), query.tries)
+        try:
+            while True:
+                now = time.monotonic()
+                for server in query.due(now):
+                    protocol.transport.sendto(packet, server)
+                    query.sent(server, now)
+                next_event = query.next_event()
+                if next_event is None:
+                    break
+                try:
+                    answer, server = await asyncio.wait_for(asyncio.shield(future), max(0.0, next_event - time.monotonic()))
+                except asyncio.TimeoutError:
+                    continue
+                query.answered(server, time.monotonic())
+                if is_truncated(answer):
+                    answer = await self.tcp_query(server, packet)
+                response = parse_response(answer)
+                if self.cache is not None:
+                    self.cache.put(name, queryNumber, response)
+                return response
+        finally:
+            protocol.pending.pop(query_id, None)
+            future.cancel()
+        raise DnsError(f"no response for {name} after {self.max_retries} tries")
+
+# one-off lookup; use an AsyncResolver to share the endpoint between many lookups
+async def resolve(name, qtype="A", ip_address="8.8.8.8", port=default_port, timeout=default_timeOut, max_retries=default_maxRetries):
+    async with AsyncResolver(ip_address, port, timeout, max_retries) as resolver:
+        return await resolver.resolve(name, qtype)
 
 # same as build packets but unbuild them to be able to decode them later 
+# ID, flags, QDCOUNT, ANCOUNT, NSCOUNT and ARCOUNT in one unpack of the 12-byte header
 def unbuild_packet(result):
-    # help from https://www.programcreek.com/python/example/3645/struct.unpack_from
-    # the idea is to unpack and increase the offset by 2 since as mentionned in the doc provided 
-    # each value is 2 bytes away
-    # we only need the firs index of the tuple 
-
-    id_unpack = struct.unpack_from(">H", result)[0]
-    flags_unpack = struct.unpack_from(">H", result, 2)[0]
-    qdCount_unpack = struct.unpack_from(">H", result, 4)[0]
-    anCount_unpack = struct.unpack_from(">H", result, 6)[0]
-    nsCount_unpack = struct.unpack_from(">H", result, 8)[0]
-    arCount_unpack = struct.unpack_from(">H", result, 10)[0]
-    
-    return id_unpack, flags_unpack, qdCount_unpack, anCount_unpack, nsCount_unpack, arCount_unpack
+    return struct.unpack_from(">HHHHHH", result)
+
+"""
+Parsed responses: the parsing below returns objects instead of printing, so the CLI, the bulk mode
+and the asyncio API share it
+"""
+# one resource record, data is the address or the name it points to (the exchange for MX)
+class DnsRecord:
+    __slots__ = ("name", "type", "data", "ttl", "preference")
+
+    def __init__(self, name, type, data, ttl, preference=None):
+        self.name = name
+        self.type = type
+        self.data = data
+        self.ttl = ttl
+        self.preference = preference # MX only
+
+    def __repr__(self):
+        return f"DnsRecord({self.name!r}, {self.type!r}, {self.data!r}, {self.ttl}, {self.preference})"
+
+    # line printed by the client: type, data, (preference,) ttl and authority
+    def format(self, auth):
+        if self.preference is not None:
+            return f"{self.type}    {self.data}    {self.preference}    {self.ttl}    {auth}"
+        return f"{self.type}    {self.data}    {self.ttl}    {auth}"
+
+class DnsResponse:
+    __slots__ = ("id", "flags", "rcode", "authoritative", "truncated", "answers", "additional")
+
+    def __init__(self, id, flags, answers, additional):
+        self.id = id
+        self.flags = flags
+        self.rcode = flags & 0b1111
+        self.authoritative = bool(flags & 0x0400) # AA bit
+        self.truncated = bool(flags & 0x0200) # TC bit
+        self.answers = answers
+        self.additional = additional
+
+    @property
+    def auth(self):
+        return "auth" if self.authoritative else "nonauth"
+
+    def __repr__(self):
+        return f"DnsResponse(id={self.id}, rcode={self.rcode}, answers={self.answers}, additional={self.additional})"
+
+# count resource records starting at pointer_position, returns the decoded ones and the position after them
+# the records of a type this client does not decode are skipped
+def parse_records(data, pointer_position, count, names):
+    records = []
+    for _ in range(count):
+        name, pointer_position = read_name(data, pointer_position, names)
+        anType, _, ttl, rdLength = _record_header.unpack_from(data, pointer_position)
+        pointer_position += 10 # TYPE, CLASS, TTL and RDLENGTH
+        if pointer_position + rdLength > len(data):
+            raise DnsError("truncated resource record")
+        record = read_rdata(data, pointer_position, anType, rdLength, names)
+        if record is not None:
+            typeLetter, dataValue, preference = record
+            records.append(DnsRecord(name, typeLetter, dataValue, ttl, preference))
+        pointer_position += rdLength
+    return records, pointer_position
+
+# whole response in one pass over the buffer: answer and additional sections (the authority section is skipped)
+# every name is decoded once, names shares the decoded suffixes between all the names of the response
+# raises DnsError for a malformed response
+def parse_response(result):
+    data = memoryview(result)
+    try:
+        id, flags, qdCount, anCount, nsCount, arCount = unbuild_packet(data)
+        names = {}
+        pointer_position = 12 # end of the header
+        for _ in range(qdCount):
+            pointer_position = read_name(data, pointer_position, names)[1] + 4 # QTYPE and QCLASS
+        answers, pointer_position = parse_records(data, pointer_position, anCount, names)
+        for _ in range(nsCount):
+            pointer_position = read_name(data, pointer_position, names)[1]
+            pointer_position += 10 + _rdlength.unpack_from(data, pointer_position + 8)[0]
+        additional, pointer_position = parse_records(data, pointer_position, arCount, names)
+    except (struct.error, UnicodeDecodeError) as error:
+        raise DnsError("malformed response: " + str(error))
+    return DnsResponse(id, flags, answers, additional)
+
+"""
+Resolver cache: parsed responses keyed by (name, QTYPE), each one kept for the smallest TTL of its records.
+A name error (RCODE 3) or an empty answer is cached negatively for negative_ttl seconds. The least recently
+used entries are evicted past max_entries, and the cache can be saved to and loaded from a JSON file
+"""
+class ResolverCache:
+    def __init__(self, max_entries=default_cache_entries, negative_ttl=default_negative_ttl):
+        self.max_entries = max_entries
+        self.negative_ttl = negative_ttl
+        self.entries = OrderedDict() # (name, qtype) -> (time stored, expiry time, response)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key(name, qtype):
+        return name.lower().rstrip("."), qtype
+
+    # the cached response with its TTLs counted down, None when absent or expired
+    def get(self, name, qtype, now=None):
+        now = time.time() if now is None else now
+        key = self.key(name, qtype)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[1] <= now:
+                del self.entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+        stored, expiry, response = entry
+        elapsed = int(now - stored)
+        def aged(records):
+            return [DnsRecord(r.name, r.type, r.data, max(0, r.ttl - elapsed), r.preference) for r in records]
+        return DnsResponse(response.id, response.flags, aged(response.answers), aged(response.additional))
+
+    # caches the response unless it is an error other than a name error, or has a TTL of 0
+    def put(self, name, qtype, response, now=None):
+        now = time.time() if now is None else now
+        if response.rcode == 0 and response.answers:
+            ttl = min(record.ttl for record in response.answers)
+        elif response.rcode in (0, 3):
+            ttl = self.negative_ttl
+        else:
+            return
+        if ttl <= 0:
+            return
+        key = self.key(name, qtype)
+        with self.lock:
+            self.entries[key] = (now, now + ttl, response)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def info(self):
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                    "entries": len(self.entries), "max_entries": self.max_entries}
+
+    # writes the live entries to path (through a temporary file, so a crash never leaves it half written)
+    def save(self, path):
+        now = time.time()
+        def rows(records):
+            return [[r.name, r.type, r.data, r.ttl, r.preference] for r in records]
+        with self.lock:
+            entries = [[name, qtype, stored, expiry, response.id, response.flags, rows(response.answers), rows(response.additional)]
+                       for (name, qtype), (stored, expiry, response) in self.entries.items() if expiry > now]
+        temporary = path + ".tmp"
+        with open(temporary, "w") as file:
+            json.dump(entries, file)
+        os.replace(temporary, path)
+
+    # adds the entries of a file written by save, the expired ones are dropped; a missing or corrupt file is ignored
+    def load(self, path):
+        try:
+            with open(path) as file:
+                entries = json.load(file)
+        except (OSError, ValueError):
+            return
+        now = time.time()
+        with self.lock:
+            for name, qtype, stored, expiry, id, flags, answers, additional in entries:
+                if expiry > now:
+                    response = DnsResponse(id, flags, [DnsRecord(*row) for row in answers], [DnsRecord(*row) for row in additional])
+                    self.entries[(name, qtype)] = (stored, expiry, response)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
 
 def display_output(result, domain_name):
-    id, flags, qdCount, anCount, nsCount, arCount = unbuild_packet(result)
-    if (anCount >= 1): # anCount is the number of Resource Records
-        print(f"***Answer Section ({anCount} records)***")
+    display_response(parse_response(result))
+
+def display_response(response):
+    display_request_error_handler(response.rcode) # check the RCODE using the helper function and print the error message if necessary
+    if (len(response.answers) >= 1):
+        print(f"***Answer Section ({len(response.answers)} records)***")
     else:
         print(f"NOTFOUND")
         exit(1)
+    for record in response.answers:
+        print(record.format(response.auth))
 
-    display_request_error_handler(result) # check the RCODE using the helper function and print the error message if necessary
-    # go through all the query names
-    # add 2 bytes to get the Query type and the Query class
-    # 12 is given from the doc for when we are done with the header
-    pointer_position = change_pointer_position(result, 12) + 4
-
-    for _ in range(anCount): # anCount is the number of resource records in the answer section
-        # this is straight from the provided document
-        pointer_position = change_pointer_position(result, pointer_position)
-        anType = struct.unpack_from(">H", result, pointer_position)[0] # TYPE (16-bit) in the Answer section
-        pointer_position += 4 # move the currentPosition 2 Bytes for Type and 2 Bytes for Class (4 bytes in total)
-
-        ttl = struct.unpack_from(">I", result, pointer_position)[0] # TTL (32-bit) in the Answer section
-        pointer_position += 4 # move the currentPosition 4 Bytes for TTL
-
-        rdLength = struct.unpack_from(">H", result, pointer_position)[0] # RDLENGTH (16-bit) in the Answer section
-        pointer_position += 2 # move the currentPosition 2 Bytes for RDLENGTH
-
-        # get the answer info and display them 
-        dataValue, pointer_position, typeLetter = get_answer_info(result, pointer_position, anType, rdLength)
-        # if least significant bit of aa is 1 then it's authoritative if not it's nonauthoritative
-        AA = flags & 0x0400 # and the 16-bit flag with 0000 0100 0000 0000 to get the AA bit
-        if (AA == 0):
-            auth = "nonauth"
-        else:
-            auth = "auth" 
+    if (len(response.additional) >= 1):
+        print(f"***Additional Section ({len(response.additional)} records)***")
+        for record in response.additional:
+            print(record.format(response.auth))
 
-        if(typeLetter == "MX"):
-            alias = dataValue.split(",")[0]
-            pref = dataValue.split(",")[1]
-            print(f"{typeLetter}    {alias}    {pref}    {ttl}    {auth}")
-        else:
-            print(f"{typeLetter}    {dataValue}    {ttl}    {auth}")
-
-        for _ in range(arCount):
-            # we need to add 10 bytes for type,class,ttl and rdlength and calculate the position again after to skip the rdata 
-            pointer_position = change_pointer_position(result, pointer_position) + 10
-            pointer_position = change_pointer_position(result, pointer_position)
-
-        while (arCount>0): # ARCOUNT is the number of resource records in the Additional section
-            print(f"***Additional Section ({arCount} records)***")
-
-            for _ in range(arCount):
-                pointer_position = change_pointer_position(result,pointer_position)
-                anType = struct.unpack_from(">H", result,pointer_position)[0]
-                pointer_position += 4 # move the currentPosition 2 Bytes for Type and 2 Bytes for Class (4 bytes in total)
-
-                ttl = struct.unpack_from(">I", result,pointer_position)[0]
-                pointer_position += 4 # move the currentPosition 4 Bytes for TTL
-
-                rdLength = struct.unpack_from(">H", result,pointer_position)[0]
-                pointer_position += 2 # move the currentPosition 2 Bytes for RDLENGTH
-
-                # display answer 
-                # we have to call the get_answer_info function again because our values have changed 
-                dataValue, pointer_position,typeLetter = get_answer_info(result,pointer_position,anType,rdLength)
-                if(typeLetter== "MX"):
-                    alias = dataValue.split(",")[0]
-                    pref = dataValue.split(",")[1]
-                    print(f"{typeLetter}    {alias}    {pref}    {ttl}    {auth}")
-                else:
-                    print(f"{typeLetter}    {dataValue}    {ttl}    {auth}")
-    
-def display_request_error_handler(result):
-    id, flags, qdCount, anCount, nsCount, arCount = unbuild_packet(result)
-    # check the RCODE in the flags
-    responseCode = flags & 0b1111 # AND the 16-bit flag with 0000 0000 0000 1111 to get the 4-bit RCODE
+# responseCode is the 4-bit RCODE of the flags (flags & 0b1111)
+def display_request_error_handler(responseCode):
     message= "" # error message
    
     if (responseCode == 1): # responseCode = 1 --> Format error
@@ -259,82 +1063,70 @@ def display_request_error_handler(result):
         print(message) # print the error message to the terminal
         exit(1)
 
-# helper function to skip the name fields we don't need
-def change_pointer_position(value, offset):
-    while True:
-        type = struct.unpack_from('>B', value, offset)[0]
-        if (type & 0xC0) == 0xC0:
-            offset += 2
-            return offset
-        if (type & 0xC0) != 0x00:
-            raise Exception("unknown label")
-        offset += 1
-        if type == 0:
-            return offset
-        offset += type
-
-def get_answer_info(result, pointer_position, anType, rdLength):
-
-    dataValue = ""
-    if (anType == 0x0001):
-        requestType= "IP"
-        an_r_data = struct.unpack_from(">"+"B" * rdLength, result, pointer_position)
-        for i in an_r_data:
-            dataValue += str(i) + "."
-        dataValue = dataValue[:-1]
-        pointer_position += rdLength
-    elif (anType == 0x0002):
-        requestType = "NS"
-        an_r_data = decode_label(result, pointer_position)  
-        for i in an_r_data:     
-            dataValue += str(i.decode("utf-8")) + '.' 
-        dataValue = dataValue[:-1]                          
-        pointer_position += rdLength
-    elif (anType == 0x0005):
-        requestType = "CNAME"
-        an_r_data = decode_label(result, pointer_position)  
-        for i in an_r_data:     
-            dataValue += str(i.decode("utf-8"))  + '.'  
-        dataValue = dataValue[:-1]                          
-        pointer_position += rdLength
-    elif (anType == 0x000f):
-        requestType = "MX"
-        attribute = struct.unpack_from(">H", result, pointer_position)[0]
-        pointer_position += 2
-        an_r_data = decode_label(result, pointer_position)
-        for i in an_r_data:     
-            dataValue += str(i.decode("utf-8"))  + '.'
-        dataValue = dataValue[:-1] 
-        dataValue += "," + str(attribute)                
-        pointer_position += rdLength
-    else:
-        raise Exception("ERROR   unvalid response")
-    
-    return dataValue, pointer_position, requestType
-# very similar to pointer position
-# to decode the bytes to a string 
-def decode_label(result, offset):
-    labelLst = []
-    while True:
-        significantBit = struct.unpack_from(">B", result, offset)[0]
+_record_header = struct.Struct(">HHIH") # TYPE, CLASS, TTL, RDLENGTH
+_rdlength = struct.Struct(">H")
 
-        if (significantBit & 0xC0) == 0xC0:
-            ref = struct.unpack_from(">H", result, offset)[0]
-            offset += 2
-            return (labelLst + decode_label(result, (ref & 0x3FFF)))
+# decodes the name at offset, returns it and the offset right after it (after the first pointer, if any)
+# names maps an offset to the name decoded from it, so a name reached again through a compression pointer
+# costs one lookup; a pointer must go backwards (RFC 1035), which also rules out pointer loops
+def read_name(data, offset, names):
+    labels = [] # (offset, label) of the labels read before reaching the end or a known suffix
+    end = None
+    position = lowest = offset # lowest: the lowest offset this name has read from
+    suffix = ""
+    while True:
+        if position in names:
+            suffix = names[position]
+            break
+        if position >= len(data):
+            raise DnsError("name runs past the end of the response")
+        length = data[position]
+        if length & 0xC0 == 0xC0: # compression pointer
+            if position + 1 >= len(data):
+                raise DnsError("name runs past the end of the response")
+            target = ((length & 0x3F) << 8) | data[position + 1]
+            if end is None:
+                end = position + 2
+            # every jump must go below all of this name, else a pointer could lead back to a label already read
+            if target >= lowest:
+                raise DnsError("compression pointer loop")
+            position = lowest = target
+            continue
+        if length & 0xC0:
+            raise DnsError("unknown label type")
+        if length == 0:
+            position += 1
+            break
+        labels.append((position, str(data[position + 1:position + 1 + length], "utf-8")))
+        position += 1 + length
+    if end is None:
+        end = position
+    # every label read starts a suffix that later names may point to
+    for label_offset, label in reversed(labels):
+        suffix = label + "." + suffix if suffix else label
+        names[label_offset] = suffix
+    return suffix, end
 
-        if (significantBit & 0xC0) != 0x00:
-            exit(1)
-        offset += 1
-        if significantBit == 0:
-            return labelLst
-        labelLst.append(*struct.unpack_from("!%ds" % significantBit, result, offset))
-        offset += significantBit
+# (type, data, preference) of the RDATA at pointer_position, None for a type this client does not decode
+# the data is the address for A, the name for NS and CNAME, the exchange for MX (with its preference)
+def read_rdata(data, pointer_position, anType, rdLength, names):
+    if anType == 0x0001:
+        if rdLength != 4:
+            raise DnsError("A record of " + str(rdLength) + " bytes")
+        return "IP", "%d.%d.%d.%d" % tuple(data[pointer_position:pointer_position + 4]), None
+    if anType == 0x0002:
+        return "NS", read_name(data, pointer_position, names)[0], None
+    if anType == 0x0005:
+        return "CNAME", read_name(data, pointer_position, names)[0], None
+    if anType == 0x000f:
+        preference = _rdlength.unpack_from(data, pointer_position)[0]
+        return "MX", read_name(data, pointer_position + 2, names)[0], preference
+    return None
 
 # summarizes the query that is going to be sent
 def summarize(domain_name, ip_address, queryType):
     print(f"DnsClient sending request for {domain_name}")
-    print(f"Server: {ip_address}")
+    print(f"Server: {ip_address if isinstance(ip_address, str) else ', '.join(ip_address)}")
     print(f"Request type: {queryType}")
 
 def invalid_type_error():
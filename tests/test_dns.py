@@ -0,0 +1,277 @@
+# Tests of the DNS client against a local stub server
+# run with: python3 -m unittest discover tests (or pytest)
+
+import asyncio
+import os
+import socket
+import struct
+import sys
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import DNS
+
+"""
+Stub DNS server on 127.0.0.1 (UDP and TCP on the same port). The first label of the queried name picks its behavior:
+    nx        NXDOMAIN
+    dropone   the first UDP query of the name is not answered
+    big       100 A records: over UDP only the TC bit, the records over TCP
+    loop      an answer whose name is a compression pointer to itself
+    wrongq    a reply to another question with the same ID, then the right reply
+anything else gets one A record 10.0.0.<length of the name>
+"""
+class StubServer:
+    def __init__(self):
+        self.udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.udp.bind(("127.0.0.1", 0))
+        self.port = self.udp.getsockname()[1]
+        self.tcp = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.tcp.bind(("127.0.0.1", self.port))
+        self.tcp.listen(8)
+        self.seen = {} # name -> number of UDP queries received
+        self.tcp_queries = 0
+        self.running = True
+        for target in (self.serve_udp, self.serve_tcp):
+            threading.Thread(target=target, daemon=True).start()
+
+    def close(self):
+        self.running = False
+        self.udp.close()
+        self.tcp.close()
+
+    @staticmethod
+    def question(query):
+        end = 12
+        while query[end]:
+            end += query[end] + 1
+        name = query[12:end]
+        labels = []
+        position = 0
+        while position < len(name):
+            labels.append(name[position + 1:position + 1 + name[position]].decode())
+            position += name[position] + 1
+        return ".".join(labels), query[12:end + 5]
+
+    @staticmethod
+    def header(query_id, flags, answers):
+        return struct.pack(">HHHHHH", query_id, 0x8180 | flags, 1, answers, 0, 0)
+
+    @staticmethod
+    def a_record(last_byte):
+        return b"\xc0\x0c" + struct.pack(">HHIH", 1, 1, 300, 4) + bytes([10, 0, 0, last_byte])
+
+    def reply(self, query, tcp):
+        query_id = struct.unpack_from(">H", query)[0]
+        name, question = self.question(query)
+        kind = name.split(".")[0]
+        if kind == "nx":
+            return [self.header(query_id, 3, 0) + question]
+        if kind == "dropone" and not tcp and self.seen[name] == 1:
+            return []
+        if kind == "big":
+            if not tcp:
+                return [self.header(query_id, 0x0200, 0) + question]
+            return [self.header(query_id, 0, 100) + question + b"".join(self.a_record(i) for i in range(100))]
+        if kind == "loop":
+            return [self.header(query_id, 0, 1) + question + b"\xc0" + bytes([12 + len(question)]) + struct.pack(">HHIH", 1, 1, 300, 4) + bytes(4)]
+        replies = []
+        if kind == "wrongq":
+            other = b"\x05other\x03com\x00" + question[-4:]
+            replies.append(self.header(query_id, 0, 1) + other + self.a_record(99))
+        return replies + [self.header(query_id, 0, 1) + question + self.a_record(len(name))]
+
+    def serve_udp(self):
+        while self.running:
+            try:
+                query, address = self.udp.recvfrom(4096)
+            except OSError:
+                return
+            name = self.question(query)[0]
+            self.seen[name] = self.seen.get(name, 0) + 1
+            for reply in self.reply(query, False):
+                self.udp.sendto(reply, address)
+
+    def serve_tcp(self):
+        while self.running:
+            try:
+                connection, _ = self.tcp.accept()
+            except OSError:
+                return
+            with connection:
+                while True:
+                    length = connection.recv(2)
+                    if len(length) < 2:
+                        break
+                    query = DNS._receive_exactly(connection, struct.unpack(">H", length)[0])
+                    self.tcp_queries += 1
+                    reply = self.reply(query, True)[-1]
+                    connection.sendall(struct.pack(">H", len(reply)) + reply)
+
+class ResolverTest(unittest.TestCase):
+    def setUp(self):
+        self.server = StubServer()
+        self.resolver = DNS.Resolver(timeout=0.3, max_retries=3)
+
+    def tearDown(self):
+        self.resolver.close()
+        self.server.close()
+
+    def resolve(self, name):
+        return self.resolver.resolve(name, "A", "127.0.0.1", self.server.port)
+
+    def test_resolve(self):
+        response = self.resolve("www.example.com")
+        self.assertEqual(response.rcode, 0)
+        self.assertEqual([(r.name, r.type, r.data, r.ttl) for r in response.answers], [("www.example.com", "IP", "10.0.0.15", 300)])
+
+    def test_retransmission_after_dropped_reply(self):
+        answer, _, retries = self.resolver.query("dropone.example.com", 1, "127.0.0.1", self.server.port)
+        self.assertEqual(retries, 1)
+        self.assertEqual(self.server.seen["dropone.example.com"], 2)
+        self.assertEqual(DNS.parse_response(answer).answers[0].data, "10.0.0.19")
+
+    def test_nxdomain(self):
+        response = self.resolve("nx.example.com")
+        self.assertEqual(response.rcode, 3)
+        self.assertEqual(response.answers, [])
+
+    def test_truncated_reply_falls_back_to_tcp(self):
+        response = self.resolve("big.example.com")
+        self.assertFalse(response.truncated)
+        self.assertEqual(len(response.answers), 100)
+        self.resolve("big.example.org")
+        self.assertEqual(self.server.tcp_queries, 2)
+        self.assertEqual(len(self.resolver.tcp.idle[("127.0.0.1", self.server.port)]), 1) # the connection was reused
+
+    def test_pointer_loop_is_rejected(self):
+        with self.assertRaises(DNS.DnsError):
+            self.resolve("loop.example.com")
+
+    def test_label_then_backward_pointer_loop_is_rejected(self):
+        # the answer name at offset 21 is the label "a" and a pointer back to that label
+        reply = StubServer.header(1, 0, 1) + b"\x01x\x00\x00\x01\x00\x01" + b"\x01a\xc0\x15" + struct.pack(">HHIH", 1, 1, 300, 4) + bytes(4)
+        with self.assertRaises(DNS.DnsError):
+            DNS.parse_response(reply)
+
+    def test_truncated_reply_is_rejected(self):
+        with self.assertRaises(DNS.DnsError):
+            DNS.parse_response(StubServer.header(1, 0, 1) + b"\x03www\x00\x00\x01\x00\x01\xc0\x0c\x00\x01")
+
+    def test_reply_to_another_question_is_ignored(self):
+        response = self.resolve("wrongq.example.com")
+        self.assertEqual(response.answers[0].data, "10.0.0.18")
+
+    def test_traffic_moves_away_from_a_silent_server(self):
+        silent = socket.socket(socket.AF_INET, socket.SOCK_DGRAM) # never answers
+        silent.bind(("127.0.0.2", self.server.port))
+        silent.setblocking(False)
+        servers = [("127.0.0.2", self.server.port), ("127.0.0.1", self.server.port)]
+        try:
+            for i in range(8):
+                _, _, _, server = self.resolver.query_servers(f"host{i}.example.com", 1, ["127.0.0.2", "127.0.0.1"], self.server.port)
+                self.assertEqual(server, servers[1])
+                # after the first race the stub is asked first, the silent server only when the stub is slow
+                self.assertEqual(self.resolver.rank(servers), servers[::-1])
+            queries = 0
+            while True:
+                try:
+                    silent.recv(512)
+                except BlockingIOError:
+                    break
+                queries += 1
+            self.assertLess(queries, 8)
+            self.assertGreater(self.resolver.stats(servers[0]).failures, 0)
+        finally:
+            silent.close()
+
+    def test_bulk_resolve(self):
+        names = ["a.example.com", "nx.example.com", "dropone.example.com", "wrongq.example.com", "big.example.com"]
+        results = {name: answer for name, answer, _ in DNS.bulk_resolve(names, 1, "127.0.0.1", self.server.port, timeout=0.3)}
+        self.assertEqual(set(results), set(names))
+        self.assertEqual(DNS.parse_response(results["a.example.com"]).answers[0].data, "10.0.0.13")
+        self.assertEqual(DNS.parse_response(results["nx.example.com"]).rcode, 3)
+        self.assertEqual(DNS.parse_response(results["wrongq.example.com"]).answers[0].name, "wrongq.example.com")
+        self.assertEqual(len(DNS.parse_response(results["big.example.com"]).answers), 100)
+
+    def test_bulk_resolve_invalid_names_and_trailing_dot(self):
+        names = ["ok.example.com", "bücher.example", "x" * 64 + ".example", "dot.example.com."]
+        results = {name: answer for name, answer, _ in DNS.bulk_resolve(names, 1, "127.0.0.1", self.server.port, timeout=0.3)}
+        self.assertEqual(set(results), set(names))
+        self.assertIsNone(results["bücher.example"])
+        self.assertIsNone(results["x" * 64 + ".example"])
+        self.assertEqual(DNS.parse_response(results["ok.example.com"]).answers[0].data, "10.0.0.14")
+        self.assertEqual(DNS.parse_response(results["dot.example.com."]).answers[0].name, "dot.example.com")
+
+    def test_bulk_resolve_moves_away_from_a_silent_server(self):
+        silent = socket.socket(socket.AF_INET, socket.SOCK_DGRAM) # never answers
+        silent.bind(("127.0.0.2", self.server.port))
+        stats = {}
+        names = [f"host{i}.example.com" for i in range(200)]
+        try:
+            results = list(DNS.bulk_resolve(names, 1, ["127.0.0.2", "127.0.0.1"], self.server.port, timeout=0.3, concurrency=8, stats=stats))
+        finally:
+            silent.close()
+        self.assertEqual(sorted(name for name, answer, _ in results if answer is not None), sorted(names))
+        silent_stats, stub_stats = stats[("127.0.0.2", self.server.port)], stats[("127.0.0.1", self.server.port)]
+        self.assertGreater(silent_stats.cost(), stub_stats.cost())
+        self.assertLess(sum(time_taken > 0.1 for _, _, time_taken in results), 20) # only the first window waited for a hedge
+
+    def test_trailing_dot_is_the_same_question(self):
+        self.assertEqual(DNS.packet_builder("www.example.com.", 1, 7), DNS.packet_builder("www.example.com", 1, 7))
+
+class AsyncResolverTest(unittest.TestCase):
+    def setUp(self):
+        self.server = StubServer()
+
+    def tearDown(self):
+        self.server.close()
+
+    def run_resolver(self, *queries):
+        async def resolve_all():
+            async with DNS.AsyncResolver("127.0.0.1", self.server.port, timeout=0.3, max_retries=3) as resolver:
+                return await asyncio.gather(*(resolver.resolve(name) for name in queries), return_exceptions=True)
+        return asyncio.run(resolve_all())
+
+    def test_concurrent_resolve(self):
+        names = [f"host{i}.example.com" for i in range(200)]
+        for name, response in zip(names, self.run_resolver(*names)):
+            self.assertEqual(response.answers[0].name, name)
+
+    def test_retransmission_nxdomain_tcp_and_errors(self):
+        dropped, nx, big, loop, wrong = self.run_resolver("dropone.example.com", "nx.example.com", "big.example.com",
+                                                          "loop.example.com", "wrongq.example.com")
+        self.assertEqual(dropped.answers[0].data, "10.0.0.19")
+        self.assertEqual(nx.rcode, 3)
+        self.assertEqual(len(big.answers), 100)
+        self.assertIsInstance(loop, DNS.DnsError)
+        self.assertEqual(wrong.answers[0].data, "10.0.0.18")
+
+    def test_race_moves_away_from_a_silent_server(self):
+        silent = socket.socket(socket.AF_INET, socket.SOCK_DGRAM) # never answers
+        silent.bind(("127.0.0.2", self.server.port))
+        silent.setblocking(False)
+
+        async def resolve_all():
+            async with DNS.AsyncResolver(["127.0.0.2", "127.0.0.1"], self.server.port, timeout=0.3) as resolver:
+                first = await resolver.resolve("first.example.com")
+                rest = await asyncio.gather(*(resolver.resolve(f"host{i}.example.com") for i in range(50)))
+                return first, rest, resolver.rank()
+        try:
+            first, rest, rank = asyncio.run(resolve_all())
+            queries = 0
+            while True:
+                try:
+                    silent.recv(512)
+                except BlockingIOError:
+                    break
+                queries += 1
+        finally:
+            silent.close()
+        self.assertEqual(first.answers[0].data, "10.0.0.17")
+        self.assertEqual([response.answers[0].name for response in rest], [f"host{i}.example.com" for i in range(50)])
+        self.assertEqual(rank[0], ("127.0.0.1", self.server.port))
+        self.assertLess(queries, 51)
+
+if __name__ == "__main__":
+    unittest.main()
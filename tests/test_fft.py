@@ -0,0 +1,156 @@
+# Tests of the transforms of Assignment2/fft.py against numpy.fft and np.convolve
+# run with: python3 -m unittest discover tests (or pytest)
+
+import os
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Assignment2"))
+import fft
+
+# power of 2, smooth (only 2, 3 and 5), with a small prime factor (dense DFT steps), prime (Bluestein) and odd sizes
+sizes = [1, 2, 8, 64, 1024, 6, 12, 100, 360, 1000, 7, 41, 77, 1025, 1001, 3, 9, 15, 97, 257, 1031]
+
+class FFTTest(unittest.TestCase):
+    def setUp(self):
+        self.rng = np.random.default_rng(0)
+
+    def signal(self, *shape):
+        return self.rng.standard_normal(shape) + 1j * self.rng.standard_normal(shape)
+
+    def assertClose(self, actual, expected, tolerance=1e-9):
+        scale = max(1.0, float(np.abs(expected).max()))
+        self.assertLess(float(np.abs(actual - expected).max()) / scale, tolerance)
+
+    def test_fft_and_inverse(self):
+        for N in sizes:
+            with self.subTest(N=N):
+                x = self.signal(3, N)
+                X = fft.FFT(x)
+                self.assertClose(X, np.fft.fft(x))
+                self.assertClose(fft.FFT_inverse(X), x)
+
+    def test_fft_along_the_first_axis(self):
+        for N in (16, 41, 1025):
+            with self.subTest(N=N):
+                x = self.signal(N, 5)
+                self.assertClose(fft.FFT(x, axis=0), np.fft.fft(x, axis=0))
+
+    def test_naive_dft(self):
+        for N in (8, 41, 100):
+            with self.subTest(N=N):
+                x = self.signal(N)
+                self.assertClose(fft.DFT_naive(x), np.fft.fft(x))
+                self.assertClose(fft.DFT_naive_inverse(x), np.fft.ifft(x))
+        y = self.signal(12, 20)
+        self.assertClose(fft.DFT_naive_2D(y), np.fft.fft2(y))
+        self.assertClose(fft.DFT_naive_2D_inverse(y), np.fft.ifft2(y))
+
+    def test_rfft_and_irfft(self):
+        for N in sizes[1:]:
+            with self.subTest(N=N):
+                x = self.rng.standard_normal((4, N))
+                X = fft.RFFT(x)
+                self.assertClose(X, np.fft.rfft(x))
+                self.assertClose(fft.IRFFT(X, N), x)
+
+    def test_2d_transforms_with_workers(self):
+        for shape in ((64, 64), (45, 77), (41, 100)):
+            for workers in (1, 3):
+                with self.subTest(shape=shape, workers=workers):
+                    image = self.rng.random(shape)
+                    X = fft.FFT_2D(image, workers=workers)
+                    self.assertClose(X, np.fft.fft2(image))
+                    self.assertClose(fft.FFT_2D_inverse(X, workers=workers), image)
+                    half = fft.RFFT_2D(image, workers=workers)
+                    self.assertClose(half, np.fft.rfft2(image))
+                    self.assertClose(fft.IRFFT_2D(half, shape, workers=workers), image)
+
+    def test_single_precision(self):
+        for result in fft.check_single_precision(sizes=(32, 1000, 1025, 1031)):
+            with self.subTest(size=result["size"]):
+                self.assertTrue(result["ok"])
+        self.assertEqual(fft.FFT(self.signal(41), dtype=np.complex64).dtype, np.complex64)
+
+    def test_memmap(self):
+        image = self.rng.random((40, 24))
+        with tempfile.TemporaryDirectory() as directory:
+            source = os.path.join(directory, "image.npy")
+            np.save(source, image)
+            # a small budget so the transform runs in several strips
+            X = fft.FFT_2D_memmap(source, os.path.join(directory, "spectrum.npy"), memory_budget=24 * 64 * 8)
+            self.assertClose(np.asarray(X), np.fft.fft2(image))
+            x = fft.FFT_2D_inverse_memmap(X, os.path.join(directory, "image2.npy"), memory_budget=24 * 64 * 8)
+            self.assertClose(np.asarray(x), image)
+            del X, x
+
+    def test_sparse_spectrum_round_trip(self):
+        image = self.rng.random((30, 45)) * 255
+        half = fft.RFFT_2D(image)
+        compressed = fft.compression(half, 0.5, save=False)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "compressed.npz")
+            fft.save_sparse_spectrum(path, compressed, 0.5, value_dtype=np.complex128, image_shape=image.shape)
+            spectrum, rate, image_shape, is_half = fft.load_sparse_spectrum(path)
+            self.assertEqual((rate, image_shape, is_half), (0.5, (30, 45), True))
+            self.assertClose(spectrum, compressed)
+            self.assertClose(fft.load_compressed_image(path), np.fft.irfft2(compressed, image.shape))
+
+            full = fft.compression(np.fft.fft2(image), 0.8, save=False)
+            fft.save_sparse_spectrum(path, full, 0.8, value_dtype=np.complex128)
+            spectrum, rate, image_shape, is_half = fft.load_sparse_spectrum(path)
+            self.assertEqual((image_shape, is_half), ((30, 45), False))
+            self.assertClose(fft.load_compressed_image(path), np.fft.ifft2(full).real)
+
+    def test_convolution(self):
+        for n, K in ((1000, 1), (1000, 31), (257, 100), (50, 50), (4099, 513)):
+            x = self.rng.standard_normal(n)
+            kernel = self.rng.standard_normal(K)
+            expected = np.convolve(x, kernel)
+            for method in ("overlap-add", "overlap-save"):
+                with self.subTest(n=n, K=K, method=method):
+                    self.assertClose(fft.fft_convolve(x, kernel, method), expected)
+                    self.assertClose(fft.fft_convolve(x, kernel, method, block=64 if K <= 64 else None), expected)
+                    self.assertClose(fft.fft_convolve(x, kernel, method, mode="same"), np.convolve(x, kernel, "same"))
+        x = self.signal(300)
+        kernel = self.signal(21)
+        self.assertClose(fft.fft_convolve(x, kernel), np.convolve(x, kernel))
+
+    def test_2d_convolution(self):
+        image = self.rng.random((70, 90))
+        for kernel_shape in ((3, 3), (9, 9), (15, 11)):
+            kernel = self.rng.random(kernel_shape)
+            # full 2D convolution as the sum of the 1D convolutions of the kernel rows with the image rows
+            expected = np.zeros((70 + kernel_shape[0] - 1, 90 + kernel_shape[1] - 1))
+            for a in range(kernel_shape[0]):
+                for i in range(70):
+                    expected[i + a] += np.convolve(image[i], kernel[a])
+            for method, block in (("auto", None), ("direct", None), ("overlap-add", None), ("overlap-add", (16, 16))):
+                with self.subTest(kernel_shape=kernel_shape, method=method, block=block):
+                    self.assertClose(fft.fft_convolve_2D(image, kernel, method, block), expected)
+
+    def test_stft_round_trip(self):
+        x = self.rng.standard_normal(5000)
+        for nperseg, hop in ((256, 64), (256, 128), (100, 25)):
+            with self.subTest(nperseg=nperseg, hop=hop):
+                S = fft.STFT(x, nperseg=nperseg, hop=hop)
+                # the signal starts nperseg - hop samples into the first frame, frame i starts at sample i*hop - front
+                front = nperseg - hop
+                i = -(-front // hop) + 1
+                start = i * hop - front
+                self.assertClose(S[i], np.fft.fft(fft.get_window("hann", nperseg) * x[start:start + nperseg]))
+                self.assertClose(fft.ISTFT(S, nperseg=nperseg, hop=hop, length=len(x)), x)
+
+    def test_streaming_stft(self):
+        x = self.rng.standard_normal(5000)
+        expected = fft.STFT(x, nperseg=256, hop=64)
+        stream = fft.StreamingSTFT(nperseg=256, hop=64)
+        frames = [stream.feed(chunk) for chunk in np.array_split(x, 37)] + [stream.flush()]
+        self.assertClose(np.concatenate(frames), expected)
+        self.assertClose(np.array(list(fft.StreamingSTFT(nperseg=256, hop=64).stream(np.array_split(x, 11)))), expected)
+
+if __name__ == "__main__":
+    unittest.main()